@@ -1,43 +1,338 @@
+import time
+# Start of the startup profile (see startup_timings)
+STARTUP_BEGAN = time.perf_counter()
+
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, flash, g, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, g, Response, jsonify, abort
+from flask import make_response, session, stream_template
+from jinja2 import FileSystemBytecodeCache
+from flask import before_render_template, template_rendered
 from datetime import datetime
+import base64
 import csv
-import pandas as pd
+import functools
+import hashlib
+import json
+import uuid
+import zlib
 import io
 import os
+import re
+import sys
+import click
+
+import database
+import dates
+import jobs
+import ledger
+import metrics
+import migrations
+import precheck
+import search
+import slowlog
+import statuses
+import summaries
+from cache import ResultCache, FragmentCacheExtension, current_generation, generation_state, bump_generation
+
+# Seconds since this module began loading, per startup phase. Printed at
+# the first response when LUMIPRO_STARTUP_PROFILE is set; also in /metrics.
+startup_timings = {'imports': time.perf_counter() - STARTUP_BEGAN}
 
 # Define the absolute path to your database file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-db_path = os.path.join(BASE_DIR, 'database.db')
+DATABASE = database.DATABASE
 
 app = Flask(__name__)
-DATABASE = 'database.db'
+
+# Compiled templates are kept on disk and shared by every worker, so a new
+# worker loads them instead of compiling (Jinja checks each against its
+# source). {% cache %} blocks are stored by cached_fragment() below.
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR') or os.path.join(BASE_DIR, '.jinja_cache')
+app.jinja_options = {**app.jinja_options, 'extensions': [FragmentCacheExtension]}
+try:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_options['bytecode_cache'] = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+except OSError:
+    pass  # read-only deploy: compile in memory as before
 
 application = app  # For passenger_wsgi compatibility
 
 app.secret_key = 'lamdashirtproductions' # Replace with a random string
 
+# Results of the heavy list/dashboard queries, reused until the next write
+result_cache = ResultCache(maxsize=int(os.environ.get('RESULT_CACHE_SIZE', 256)))
+# Rendered {% cache %} blocks, bounded by their total size (characters of HTML)
+fragment_cache = ResultCache(maxbytes=int(os.environ.get('FRAGMENT_CACHE_MB', 32)) * 2 ** 20)
+
+# Send a Server-Timing header (total / db / tpl / app) with every response
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '') not in ('', '0')
+
+# Opt-in: statements at or over SLOW_QUERY_MS are logged with their query plan
+app.config['SLOW_QUERY_MS'] = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+slow_query_log = slowlog.SlowQueryLog(os.environ.get('SLOW_QUERY_LOG') or os.path.join(BASE_DIR, 'slow_queries.log'))
+
+
+# Uploaded CSVs wait here until their background import job has run
+UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+
+
+def _trace(db):
+    # Used by `flask explain-routes` to collect every statement a route runs
+    trace = app.config.get('SQL_TRACE')
+    db.set_trace_callback(trace.append if trace is not None else None)
+    return db
+
+def connect_db():
+    """A new connection of its own, for background jobs and streamed exports."""
+    return _trace(database.connect())
+
+def watched(db, endpoint):
+    """
+    `db` instrumented for the slow-query log, for the connections that live
+    outside a request: the writer's, import jobs' and the export's. Each
+    statement is logged under `endpoint` as soon as it finishes, so its plan
+    is taken while the temp tables it reads still exist. Returned as is
+    while SLOW_QUERY_MS is off.
+    """
+    if app.config['SLOW_QUERY_MS'] is None:
+        return db
+    return metrics.InstrumentedConnection(
+        db, metrics.RequestStats(keep_queries=True),
+        on_close=lambda conn: flush_slow_queries(conn, endpoint),
+        on_finish=lambda conn, query: log_slow_query(conn, query, endpoint))
+
+def log_slow_query(db, query, endpoint, method=None):
+    """Log one finished statement of `db` if it took SLOW_QUERY_MS or longer."""
+    threshold = app.config['SLOW_QUERY_MS']
+    if threshold is not None and query[2] * 1000 >= threshold:
+        slow_query_log.capture(db.connection, [query], threshold, endpoint, method)
+
+def flush_slow_queries(db, endpoint, method=None):
+    """
+    Log the statements an instrumented connection has run since the last
+    flush (or, with on_finish, still has running) that took SLOW_QUERY_MS
+    or longer, then forget them all.
+    """
+    stats = getattr(db, 'stats', None)
+    if not stats or not stats.queries:
+        return
+    queries, stats.queries = stats.queries, []
+    threshold = app.config['SLOW_QUERY_MS']
+    if threshold is not None:
+        # Explain on the raw connection, so the EXPLAINs aren't counted themselves
+        slow_query_log.capture(db.connection, queries, threshold, endpoint, method)
+
+jobs.configure(lambda: watched(connect_db(), 'import_job'))
+
+def before_write_commit(db):
+    """Housekeeping done inside every write transaction, just before it commits."""
+    ledger.maybe_snapshot(db)
+    bump_generation(db, commit=False)
+
+# Every write made while handling a request goes through this queue, which
+# commits concurrent writes together and bumps the cache generation with them.
+db_writer = database.Writer(before_commit=before_write_commit,
+                            after_batch=lambda db: flush_slow_queries(db, 'db_writer'),
+                            connect=lambda: watched(database.connect(), 'db_writer'))
 
 def get_db():
+    """The worker thread's reused read-only connection (see database.py).
+
+    Writes go through db_writer instead. Statements, rows and SQLite time
+    are counted towards the request's metrics.
+    """
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = metrics.InstrumentedConnection(_trace(database.thread_connection()),
+                                                          request_stats())
     return db
 
-def init_db():
-    with app.app_context():
-        db = get_db()
-        with open('schema.sql', mode='r') as f:
+def request_stats():
+    """Performance counters for the current request (see metrics.py)."""
+    stats = g.get('_request_stats')
+    if stats is None:
+        stats = g._request_stats = metrics.RequestStats()
+    return stats
+
+def init_db(recover=True):
+    """
+    Create missing tables from schema.sql, then apply pending migrations.
+    With recover, also re-run imports left behind by a stopped worker.
+    """
+    db = connect_db()
+    try:
+        database.enable_wal(db)
+        with open(os.path.join(BASE_DIR, 'schema.sql'), mode='r') as f:
             db.cursor().executescript(f.read())
         db.commit()
-        print("Database Initialized!")
+        applied = migrations.migrate(db)
+        for version, description in applied:
+            print(f"Applied migration {version}: {description}")
+        statuses.load_codes(db)
+        print(f"Database Initialized! (schema version {migrations.current_version(db)})")
+    finally:
+        db.close()
+    if recover:
+        recover_jobs()
+
+def recover_jobs():
+    """
+    Re-queue orphaned imports on this process's job pool (see jobs.recover).
+    Each job is claimed atomically, so when several workers start at once
+    exactly one of them picks it up.
+    """
+    db = connect_db()
+    try:
+        requeued = jobs.recover(db)
+        if requeued:
+            print(f"Re-queued {requeued} import job(s) left behind by a stopped worker.")
+    finally:
+        db.close()
+
+def cached_result(compute):
+    """
+    Return compute() via the result cache.
+
+    Keyed by the current route and its URL/query arguments; the entry is
+    reused only while the data generation is unchanged.
+    """
+    key = (request.endpoint,
+           tuple(sorted((request.view_args or {}).items())),
+           tuple(sorted(request.args.items(multi=True))))
+    return result_cache.get_or_compute(key, current_generation(get_db()), compute)
+
+def cached_fragment(key, render):
+    """Storage for {% cache %} template blocks: reused until the next write."""
+    return fragment_cache.get_or_compute(key, current_generation(get_db()), render)
+
+app.jinja_env.fragment_cache = cached_fragment
+
+# Characters per write when streaming a page
+STREAM_CHUNK_SIZE = 16 * 1024
+
+def stream_page(template, **context):
+    """
+    Render a large page as a stream, so the browser starts painting before
+    the last row is rendered. stream_template() yields every template
+    node separately; this regroups its output into STREAM_CHUNK_SIZE writes.
+    """
+    # Created here, while the request is active; it keeps the request
+    # context alive until the last piece has been sent
+    pieces = stream_template(template, **context)
+
+    def chunks():
+        buffer, size = [], 0
+        for piece in pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        yield ''.join(buffer)
+    return chunks()
+
+def _code_version():
+    # Newest mtime of the code and templates: part of every ETag, so a
+    # deploy never answers 304 for a page that would now render differently
+    paths = [os.path.join(BASE_DIR, 'app.py')]
+    templates = os.path.join(BASE_DIR, 'templates')
+    paths += [os.path.join(templates, name) for name in os.listdir(templates)]
+    return max(os.path.getmtime(p) for p in paths)
+
+CODE_VERSION = _code_version()
+
+def conditional_get(view):
+    """
+    Answer a GET with 304 Not Modified, before the view runs a query or
+    renders anything, when the client's ETag (or Last-Modified date) is
+    still current.
+
+    The ETag hashes the data generation with the endpoint, its arguments
+    and the headers pages vary on, so any write changes it and no two
+    pages or formats share one.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # A 304 would swallow a pending flash message
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return view(*args, **kwargs)
+        generation, modified_at = generation_state(get_db())
+        key = repr((CODE_VERSION, generation, request.endpoint,
+                    sorted((request.view_args or {}).items()),
+                    sorted(request.args.items(multi=True)),
+                    request.headers.get('Accept', ''), request.headers.get('X-Requested-With', '')))
+        etag = hashlib.sha1(key.encode()).hexdigest()[:24]
+        # A write later in the current second keeps the same modified_at,
+        # so a date only proves freshness once that second is over
+        last_modified = modified_at if 0 < modified_at < int(time.time()) else None
+
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            fresh = bool(last_modified and since and since.timestamp() >= last_modified)
+
+        if fresh:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Cacheable, but only after checking back with us
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.update(('Accept', 'X-Requested-With'))
+        return response
+    return wrapper
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    # The connection stays open for the thread's next request; just make
+    # sure nothing a failed view left uncommitted leaks into it.
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        database.release(db)
+
+@app.before_request
+def start_request_stats():
+    g._request_stats = metrics.RequestStats(keep_queries=app.config['SLOW_QUERY_MS'] is not None)
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('_template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    started = g.get('_template_started')
+    if started:
+        request_stats().template_time += time.perf_counter() - started.pop()
+
+@app.after_request
+def record_request_stats(response):
+    # Streamed responses (the export) are measured up to their first byte
+    stats = request_stats()
+    wall = time.perf_counter() - stats.started
+    metrics.REGISTRY.observe(request.endpoint or 'unmatched', request.method, response.status_code,
+                             stats, wall)
+    if 'first_response' not in startup_timings:
+        startup_timings['first_response'] = time.perf_counter() - STARTUP_BEGAN
+        if os.environ.get('LUMIPRO_STARTUP_PROFILE'):
+            print("Startup profile (seconds since app.py began loading): " +
+                  ", ".join(f"{phase} {seconds:.3f}" for phase, seconds in startup_timings.items()),
+                  file=sys.stderr)
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = stats.server_timing(wall)
+    db = g.get('_database')
+    if stats.queries is not None and db is not None:
+        endpoint, method = request.endpoint or 'unmatched', request.method
+        if response.is_streamed:
+            # A streamed page goes on reading rows after this point
+            response.call_on_close(lambda: flush_slow_queries(db, endpoint, method))
+        else:
+            flush_slow_queries(db, endpoint, method)
+    return response
 
 # --- ROUTES ---
 
@@ -52,14 +347,14 @@ def manage_clients():
     """List all clients and their contact information."""
     db = get_db()
     # Fetch clients along with a count of how many units they currently have
-    clients = db.execute("""
+    clients = cached_result(lambda: db.execute("""
         SELECT 
             c.*, 
             COUNT(s.id) as unit_count
         FROM clients c
         LEFT JOIN stock s ON c.id = s.client_id
         GROUP BY c.id
-    """).fetchall()
+    """).fetchall())
     
     return render_template('manage_clients.html', 
                            data=clients, 
@@ -79,10 +374,8 @@ def add_client():
         flash("Client name is required.", "danger")
         return redirect(url_for('manage_clients'))
         
-    db = get_db()
-    db.execute("INSERT INTO clients (name, contact_info) VALUES (?, ?)", 
-               (name, contact_info))
-    db.commit()
+    db_writer.execute("INSERT INTO clients (name, contact_info) VALUES (?, ?)", 
+                      (name, contact_info))
     flash(f"Client '{name}' added successfully.", "success")
     return redirect(url_for('manage_clients'))
 
@@ -98,18 +391,22 @@ def view_client(id):
         flash("Client not found.", "danger")
         return redirect(url_for('manage_clients'))
     
-    # Fetch all stock units assigned to this client
-    # We join with fixtures to get the readable names of the equipment
+    unit_count = db.execute("SELECT COUNT(*) FROM stock WHERE client_id = ?", (id,)).fetchone()[0]
+
+    # All stock units assigned to this client, joined with fixtures for the
+    # readable names. Rows are read off the cursor as the page streams out
+    # (and not at all while the table fragment is cached).
     stocks = db.execute("""
         SELECT s.*, f.name as fixture_name 
         FROM stock s
         JOIN fixtures f ON s.fixture_id = f.id
         WHERE s.client_id = ?
-    """, (id,)).fetchall()
+    """, (id,))
     
-    return render_template('view_client.html', 
-                           client=client, 
-                           stocks=stocks)
+    return stream_page('view_client.html', 
+                       client=client, 
+                       stocks=stocks,
+                       unit_count=unit_count)
 
 # 3. EDIT CLIENT
 
@@ -119,10 +416,8 @@ def edit_client(id):
     name = request.form.get('name')
     contact_info = request.form.get('contact_info')
     
-    db = get_db()
-    db.execute("UPDATE clients SET name = ?, contact_info = ? WHERE id = ?", 
-               (name, contact_info, id))
-    db.commit()
+    db_writer.execute("UPDATE clients SET name = ?, contact_info = ? WHERE id = ?", 
+                      (name, contact_info, id))
     flash("Client information updated.", "success")
     return redirect(url_for('manage_clients'))
 
@@ -139,8 +434,7 @@ def delete_client(id):
         flash("Cannot delete client. Please reassign or remove their equipment first.", "warning")
         return redirect(url_for('manage_clients'))
         
-    db.execute("DELETE FROM clients WHERE id = ?", (id,))
-    db.commit()
+    db_writer.execute("DELETE FROM clients WHERE id = ?", (id,))
     flash("Client deleted successfully.", "success")
     return redirect(url_for('manage_clients'))
 
@@ -175,10 +469,8 @@ def add_fixture_type():
         flash("Category name cannot be empty.", "danger")
         return redirect(url_for('manage_fixture_types'))
         
-    db = get_db()
     try:
-        db.execute("INSERT INTO fixture_types (name) VALUES (?)", (name,))
-        db.commit()
+        db_writer.execute("INSERT INTO fixture_types (name) VALUES (?)", (name,))
         flash(f"Category '{name}' created.", "success")
     except sqlite3.IntegrityError:
         flash("This category already exists.", "warning")
@@ -191,9 +483,7 @@ def add_fixture_type():
 def edit_fixture_type(id):
     """Rename an existing category."""
     new_name = request.form.get('name')
-    db = get_db()
-    db.execute("UPDATE fixture_types SET name = ? WHERE id = ?", (new_name, id))
-    db.commit()
+    db_writer.execute("UPDATE fixture_types SET name = ? WHERE id = ?", (new_name, id))
     flash("Category updated successfully.", "success")
     return redirect(url_for('manage_fixture_types'))
 
@@ -210,8 +500,7 @@ def delete_fixture_type(id):
     if usage_check['count'] > 0:
         flash("Cannot delete: This category is still assigned to active fixture models.", "danger")
     else:
-        db.execute("DELETE FROM fixture_types WHERE id = ?", (id,))
-        db.commit()
+        db_writer.execute("DELETE FROM fixture_types WHERE id = ?", (id,))
         flash("Category removed.", "success")
         
     return redirect(url_for('manage_fixture_types'))
@@ -219,7 +508,12 @@ def delete_fixture_type(id):
 # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<< FIXTURES <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 
 @app.route('/fixtures')
+@conditional_get
 def manage_fixtures():
+    return render_template('manage_fixtures.html', **cached_result(load_fixture_list))
+
+def load_fixture_list():
+    """Queries behind /fixtures, returned as template context."""
     db = get_db()
     # 1. Fetch Master Fixture List
     fixtures = db.execute("""
@@ -233,13 +527,14 @@ def manage_fixtures():
 
     # 2. Fetch Stock Counts grouped by Fixture and Warehouse
     # This creates a mapping of where everything is
-    stock_distribution = db.execute("""
+    in_stock = statuses.codes_in('in_stock')
+    stock_distribution = db.execute(f"""
         SELECT s.fixture_id, w.name as warehouse_name, COUNT(s.id) as quantity
         FROM stock s
         JOIN warehouses w ON s.warehouse_id = w.id
-        WHERE s.status IN ('In Warehouse', 'FOR SALE')
+        WHERE s.status IN ({statuses.placeholders(in_stock)})
         GROUP BY s.fixture_id, w.id
-    """).fetchall()
+    """, in_stock).fetchall()
 
     # Convert distribution to a dictionary for easy template access
     # Format: {fixture_id: [ {'warehouse_name': 'Main', 'quantity': 5}, ... ]}
@@ -253,11 +548,10 @@ def manage_fixtures():
     types = db.execute("SELECT * FROM fixture_types").fetchall()
     suppliers = db.execute("SELECT * FROM suppliers").fetchall()
     
-    return render_template('manage_fixtures.html', 
-                           fixtures=fixtures, 
-                           types=types, 
-                           suppliers=suppliers, 
-                           dist_map=dist_map)
+    return dict(fixtures=fixtures, 
+                types=types, 
+                suppliers=suppliers, 
+                dist_map=dist_map)
 
 # --- FIXTURE CRUD OPERATIONS ---
 
@@ -288,14 +582,13 @@ def add_fixture():
         )
         
         try:
-            db.execute("""
+            db_writer.execute("""
                 INSERT INTO fixtures (
                     name, model_name, factory_model_name, sku, type_id, 
                     supplier_id, power_watts, color, beam_angle, ip_rating, weight_kg, 
                     cost, price_sgd, price_usd, remarks
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, data)
-            db.commit()
             flash(f"Fixture model '{request.form.get('name')}' added.", "success")
             return redirect(url_for('manage_fixtures'))
         except sqlite3.IntegrityError:
@@ -351,14 +644,13 @@ def edit_fixture(id):
             request.form.get('remarks'),
             id
         )
-        db.execute("""
+        db_writer.execute("""
             UPDATE fixtures SET 
                 name=?, model_name=?, factory_model_name=?, sku=?, type_id=?, 
                 supplier_id=?, power_watts=?, color=?, beam_angle=?, ip_rating=?, weight_kg=?,
                 cost=?, price_sgd=?, price_usd=?, remarks=?
             WHERE id=?
         """, data)
-        db.commit()
         flash("Fixture model updated.", "success")
         return redirect(url_for('manage_fixtures'))
 
@@ -377,8 +669,7 @@ def delete_fixture(id):
     if check['count'] > 0:
         flash("Cannot delete: Inventory units exist for this model. Remove stock first.", "danger")
     else:
-        db.execute("DELETE FROM fixtures WHERE id = ?", (id,))
-        db.commit()
+        db_writer.execute("DELETE FROM fixtures WHERE id = ?", (id,))
         flash("Fixture model removed from database.", "success")
     return redirect(url_for('manage_fixtures'))
 
@@ -389,14 +680,14 @@ def manage_suppliers():
     """List all suppliers/factories and their contact details."""
     db = get_db()
     # Fetch suppliers and count how many unique fixture profiles are linked to them
-    suppliers = db.execute("""
+    suppliers = cached_result(lambda: db.execute("""
         SELECT 
             s.*, 
             COUNT(f.id) as fixture_count
         FROM suppliers s
         LEFT JOIN fixtures f ON s.id = f.supplier_id
         GROUP BY s.id
-    """).fetchall()
+    """).fetchall())
     
     return render_template('manage_suppliers.html', suppliers=suppliers)
 
@@ -416,12 +707,10 @@ def add_supplier():
         flash("Supplier name is required.", "danger")
         return redirect(url_for('manage_suppliers'))
         
-    db = get_db()
-    db.execute("""
+    db_writer.execute("""
         INSERT INTO suppliers (name, contact_person, email, phone) 
         VALUES (?, ?, ?, ?)
     """, (name, contact_person, email, phone))
-    db.commit()
     flash(f"Supplier '{name}' added successfully.", "success")
     return redirect(url_for('manage_suppliers'))
 
@@ -435,13 +724,11 @@ def edit_supplier(id):
     email = request.form.get('email')
     phone = request.form.get('phone')
     
-    db = get_db()
-    db.execute("""
+    db_writer.execute("""
         UPDATE suppliers 
         SET name = ?, contact_person = ?, email = ?, phone = ? 
         WHERE id = ?
     """, (name, contact_person, email, phone, id))
-    db.commit()
     flash("Supplier information updated.", "success")
     return redirect(url_for('manage_suppliers'))
 
@@ -458,8 +745,7 @@ def delete_supplier(id):
         flash("Cannot delete: This supplier has linked fixture profiles.", "warning")
         return redirect(url_for('manage_suppliers'))
         
-    db.execute("DELETE FROM suppliers WHERE id = ?", (id,))
-    db.commit()
+    db_writer.execute("DELETE FROM suppliers WHERE id = ?", (id,))
     flash("Supplier deleted.", "success")
     return redirect(url_for('manage_suppliers'))
 
@@ -470,14 +756,14 @@ def manage_warehouses():
     """List all warehouses and the count of units currently in stock there."""
     db = get_db()
     # Fetch warehouses with a count of active stock units
-    warehouses = db.execute("""
+    warehouses = cached_result(lambda: db.execute("""
         SELECT 
             w.id, w.name, w.location, 
             COUNT(s.id) as unit_count
         FROM warehouses w
         LEFT JOIN stock s ON w.id = s.warehouse_id
         GROUP BY w.id
-    """).fetchall()
+    """).fetchall())
     
     return render_template('manage_warehouses.html', warehouses=warehouses)
 
@@ -495,9 +781,7 @@ def add_warehouse():
         flash("Warehouse name is required.", "danger")
         return redirect(url_for('manage_warehouses'))
         
-    db = get_db()
-    db.execute("INSERT INTO warehouses (name, location) VALUES (?, ?)", (name, location))
-    db.commit()
+    db_writer.execute("INSERT INTO warehouses (name, location) VALUES (?, ?)", (name, location))
     flash(f"Warehouse '{name}' added successfully.", "success")
     return redirect(url_for('manage_warehouses'))
 
@@ -513,15 +797,18 @@ def view_warehouse(id):
         flash("Warehouse not found.", "danger")
         return redirect(url_for('manage_warehouses'))
     
-    # Fetch all stock units in this warehouse with fixture names
+    unit_count = db.execute("SELECT COUNT(*) FROM stock WHERE warehouse_id = ?", (id,)).fetchone()[0]
+
+    # Stock units in this warehouse with fixture names, read off the cursor
+    # as the page streams out (and not at all while the table is cached)
     stocks = db.execute("""
         SELECT s.*, f.name as fixture_name 
         FROM stock s
         JOIN fixtures f ON s.fixture_id = f.id
         WHERE s.warehouse_id = ?
-    """, (id,)).fetchall()
+    """, (id,))
     
-    return render_template('view_warehouse.html', warehouse=warehouse, stocks=stocks)
+    return stream_page('view_warehouse.html', warehouse=warehouse, stocks=stocks, unit_count=unit_count)
 
 # 3. EDIT WAREHOUSE
 
@@ -531,9 +818,7 @@ def edit_warehouse(id):
     name = request.form.get('name')
     location = request.form.get('location')
     
-    db = get_db()
-    db.execute("UPDATE warehouses SET name = ?, location = ? WHERE id = ?", (name, location, id))
-    db.commit()
+    db_writer.execute("UPDATE warehouses SET name = ?, location = ? WHERE id = ?", (name, location, id))
     flash("Warehouse updated.", "success")
     return redirect(url_for('manage_warehouses'))
 
@@ -550,32 +835,342 @@ def delete_warehouse(id):
         flash("Cannot delete: This warehouse still contains stock units.", "warning")
         return redirect(url_for('manage_warehouses'))
         
-    db.execute("DELETE FROM warehouses WHERE id = ?", (id,))
-    db.commit()
+    db_writer.execute("DELETE FROM warehouses WHERE id = ?", (id,))
     flash("Warehouse removed.", "success")
     return redirect(url_for('manage_warehouses'))
 
 # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<< STOCK <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<\
 
-@app.route('/stock')
-def manage_stock():
-    """List all individual stock units with their status and location."""
-    db = get_db()
-    # Fetch all stock units with fixture names, warehouse names, and client names
-    stocks = db.execute("""
+# Sort keys accepted by /stock. Each maps to the SQL expression used for
+# ordering and its direction; ties are always broken on s.id so the order is
+# total and keyset pagination never skips or repeats a row.
+STOCK_SORTS = {
+    'newest': ('s.id', 'DESC'),
+    'oldest': ('s.id', 'ASC'),
+    'serial': ("COALESCE(s.serial_number, '')", 'ASC'),
+    'model': ('f.name', 'ASC'),
+    'status': ('s.status', 'ASC'),
+}
+STOCK_PAGE_SIZE = 50
+STOCK_MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort_value, row_id):
+    """Pack the (sort value, id) of a boundary row into an opaque URL token."""
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor. Returns None for a missing or mangled token."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def serial_prefix_bounds(prefix):
+    """
+    Half-open [low, high) bounds covering every serial that starts with
+    `prefix`, so the lookup is a range scan of the serial_number index
+    (LIKE 'prefix%' can't use it: LIKE is case-insensitive).
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def serial_range(start, end):
+    """
+    Inclusive (first, last) serials of a run. A `end` shorter than `start`
+    replaces the tail of `start`: ('LP-2024-000100', '599') covers
+    LP-2024-000100 to LP-2024-000599. Either side may be None (open).
+    """
+    start = (start or '').strip()
+    end = (end or '').strip()
+    if start and end and len(end) < len(start):
+        end = start[:len(start) - len(end)] + end
+    return start or None, end or None
+
+
+def stock_filters_from_args(args):
+    """Read the /stock filter parameters from a request's query string."""
+    serial_from, serial_to = serial_range(args.get('serial_from'), args.get('serial_to'))
+    return {
+        'q': (args.get('q') or '').strip(),
+        'fixture_id': args.get('fixture_id', type=int),
+        'status': statuses.normalize_status(args.get('status')),
+        'client_id': args.get('client_id', type=int),
+        'warehouse_id': args.get('warehouse_id', type=int),
+        'serial_from': serial_from,
+        'serial_to': serial_to,
+    }
+
+
+def stock_where(filters):
+    """Build the WHERE clause and parameters for a set of stock filters."""
+    clauses = []
+    params = []
+    if filters.get('q'):
+        clauses.append("s.serial_number LIKE ?")
+        params.append(f"%{filters['q']}%")
+    if filters.get('fixture_id'):
+        clauses.append("s.fixture_id = ?")
+        params.append(filters['fixture_id'])
+    if filters.get('status'):
+        clauses.append("s.status = ?")
+        params.append(filters['status'])
+    if filters.get('client_id'):
+        clauses.append("s.client_id = ?")
+        params.append(filters['client_id'])
+    if filters.get('warehouse_id'):
+        clauses.append("s.warehouse_id = ?")
+        params.append(filters['warehouse_id'])
+    # Serial runs compare as text, which is numeric order for fixed-width runs
+    if filters.get('serial_from'):
+        clauses.append("s.serial_number >= ?")
+        params.append(filters['serial_from'])
+    if filters.get('serial_to'):
+        clauses.append("s.serial_number <= ?")
+        params.append(filters['serial_to'])
+    return clauses, params
+
+
+def fetch_stock_page(db, filters, sort='newest', after=None, before=None, per_page=STOCK_PAGE_SIZE):
+    """
+    Return one page of stock rows using keyset (seek) pagination.
+
+    Instead of OFFSET, the page boundary is the (sort value, id) of the last
+    row the client saw, so the database seeks straight to it and page 500
+    costs the same as page 1. Passing `before` walks backwards from the
+    first row of the current page.
+
+    Returns (rows, prev_cursor, next_cursor).
+    """
+    expr, direction = STOCK_SORTS.get(sort, STOCK_SORTS['newest'])
+    clauses, params = stock_where(filters)
+
+    backwards = before is not None
+    cursor = before if backwards else after
+    # Walking backwards means seeking and ordering the opposite way, then
+    # flipping the fetched rows back into display order.
+    order = direction
+    if backwards:
+        order = 'ASC' if direction == 'DESC' else 'DESC'
+    op = '>' if order == 'ASC' else '<'
+
+    if cursor is not None:
+        sort_value, row_id = cursor
+        if expr == 's.id':
+            clauses.append(f"s.id {op} ?")
+            params.append(row_id)
+        else:
+            clauses.append(f"({expr} {op} ? OR ({expr} = ? AND s.id {op} ?))")
+            params.extend([sort_value, sort_value, row_id])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    tiebreak = "" if expr == 's.id' else f", s.id {order}"
+    rows = db.execute(f"""
         SELECT 
             s.*, 
             f.name as fixture_name,
             w.name as warehouse_name,
-            c.name as client_name
+            c.name as client_name,
+            {expr} as sort_key
         FROM stock s
         JOIN fixtures f ON s.fixture_id = f.id
         LEFT JOIN warehouses w ON s.warehouse_id = w.id
         LEFT JOIN clients c ON s.client_id = c.id
-        ORDER BY s.id DESC
-    """).fetchall()
-    
-    return render_template('manage_stocks.html', stocks=stocks)
+        {where}
+        ORDER BY {expr} {order}{tiebreak}
+        LIMIT ?
+    """, params + [per_page + 1]).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    prev_cursor = next_cursor = None
+    if rows:
+        first = encode_cursor(rows[0]['sort_key'], rows[0]['id'])
+        last = encode_cursor(rows[-1]['sort_key'], rows[-1]['id'])
+        if backwards:
+            prev_cursor = first if has_more else None
+            next_cursor = last
+        else:
+            prev_cursor = first if after is not None else None
+            next_cursor = last if has_more else None
+    return rows, prev_cursor, next_cursor
+
+
+# Dropdown filters on /stock that show how many units each choice matches
+STOCK_FACETS = ('fixture_id', 'status', 'client_id', 'warehouse_id')
+
+# Summary table -> the filters it can answer (see summaries.py). Units
+# without a warehouse sit under warehouse_id 0; units without a client
+# are not in the client summary, which is fine for counting clients.
+FACET_SUMMARIES = {
+    'stock_summary_warehouse': ('warehouse_id', 'fixture_id', 'status'),
+    'stock_summary_client': ('client_id', 'fixture_id', 'status'),
+}
+
+
+def facet_counts(db, filters, facet):
+    """
+    Units per value of `facet` among the units matching every *other*
+    filter (a facet never narrows its own choices). Returns {value: count}.
+
+    Read from a summary table when it holds all the columns involved,
+    otherwise grouped over stock through its indexes.
+    """
+    others = {k: v for k, v in filters.items() if v and k != facet}
+    for table, columns in FACET_SUMMARIES.items():
+        if facet in columns and set(others) <= set(columns):
+            conditions = [f"{k} = ?" for k in others]
+            if facet == 'warehouse_id':
+                conditions.append("warehouse_id <> 0")
+            return dict(db.execute(f"""
+                SELECT {facet}, SUM(qty) FROM {table}
+                WHERE {' AND '.join(conditions) or '1'}
+                GROUP BY {facet}
+                HAVING SUM(qty) > 0
+            """, list(others.values())).fetchall())
+
+    clauses, params = stock_where(others)
+    clauses.append(f"s.{facet} IS NOT NULL")
+    return dict(db.execute(f"""
+        SELECT s.{facet}, COUNT(*) FROM stock s
+        WHERE {' AND '.join(clauses)}
+        GROUP BY s.{facet}
+    """, params).fetchall())
+
+
+def load_stock_facets(db, filters):
+    """Counts for every facet plus the number of units matching all filters."""
+    facets = {facet: facet_counts(db, filters, facet) for facet in STOCK_FACETS}
+    # Every unit has a status, so the status facet also gives the total
+    status_counts = facets['status']
+    total = status_counts.get(filters['status'], 0) if filters.get('status') else sum(status_counts.values())
+    return {'total': total, 'facets': facets}
+
+
+@app.route('/stock/facets')
+@conditional_get
+def stock_facets():
+    """
+    Facet counts for the /stock filters as JSON, for the query string the
+    page is showing: {"total": n, "facets": {"status": {"SOLD": 12, ...}, ...}}.
+    Values matching no unit are left out.
+    """
+    filters = stock_filters_from_args(request.args)
+    return jsonify(cached_result(lambda: load_stock_facets(get_db(), filters)))
+
+
+@app.route('/stock')
+@conditional_get
+def manage_stock():
+    """
+    List stock units one page at a time.
+
+    Filtering, sorting and paging all happen in SQL; the page only ever holds
+    `per_page` rows. With `partial=1` just the table rows and pager are
+    rendered so the page script can swap them in without a full reload.
+    """
+    db = get_db()
+    filters = stock_filters_from_args(request.args)
+    sort = request.args.get('sort', 'newest')
+    if sort not in STOCK_SORTS:
+        sort = 'newest'
+    per_page = request.args.get('per_page', STOCK_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, STOCK_MAX_PAGE_SIZE))
+
+    stocks, prev_cursor, next_cursor = fetch_stock_page(
+        db, filters, sort=sort,
+        after=decode_cursor(request.args.get('after')),
+        before=decode_cursor(request.args.get('before')),
+        per_page=per_page)
+
+    # Query string shared by the pager links (everything except the cursor)
+    base_args = {k: v for k, v in request.args.items() if k not in ('after', 'before', 'partial', 'job')}
+
+    if request.args.get('partial'):
+        return render_template('stock_rows.html', stocks=stocks, base_args=base_args,
+                               prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+    fixtures = db.execute("SELECT id, name FROM fixtures ORDER BY name ASC").fetchall()
+    clients = db.execute("SELECT id, name FROM clients ORDER BY name ASC").fetchall()
+    warehouses = db.execute("SELECT id, name FROM warehouses ORDER BY name ASC").fetchall()
+    status_list = db.execute("SELECT code, label FROM statuses ORDER BY rowid").fetchall()
+
+    return render_template('manage_stocks.html', 
+                           stocks=stocks,
+                           filters=filters,
+                           sort=sort,
+                           sorts=STOCK_SORTS,
+                           per_page=per_page,
+                           base_args=base_args,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor,
+                           fixtures=fixtures,
+                           clients=clients,
+                           warehouses=warehouses,
+                           statuses=status_list,
+                           job_id=request.args.get('job', type=int))
+
+# Serials returned per autocomplete / range lookup
+SERIAL_LOOKUP_LIMIT = 20
+SERIAL_MAX_LOOKUP_LIMIT = 200
+
+
+@app.route('/stock/serials')
+def serial_lookup():
+    """
+    Serial autocomplete and range lookup (JSON), served by range scans of
+    the serial_number index.
+
+    `?prefix=LP-2024-0001` returns the first `limit` serials starting with
+    the prefix; a lower-case prefix falls back to its upper-case form.
+    `?from=LP-2024-000100&to=599` returns how many units fall in the
+    inclusive run plus the first `limit` of them, and the /stock URL that
+    selects the whole run.
+    """
+    db = get_db()
+    limit = max(1, min(request.args.get('limit', SERIAL_LOOKUP_LIMIT, type=int), SERIAL_MAX_LOOKUP_LIMIT))
+    select = """
+        SELECT s.id, s.serial_number, s.status, f.name AS fixture_name
+        FROM stock s
+        JOIN fixtures f ON s.fixture_id = f.id
+    """
+
+    prefix = (request.args.get('prefix') or '').strip()
+    if prefix:
+        rows = []
+        for candidate in dict.fromkeys([prefix, prefix.upper()]):
+            rows = db.execute(select + """
+                WHERE s.serial_number >= ? AND s.serial_number < ?
+                ORDER BY s.serial_number
+                LIMIT ?
+            """, (*serial_prefix_bounds(candidate), limit)).fetchall()
+            if rows:
+                break
+        return jsonify({'prefix': prefix, 'serials': [dict(r) for r in rows]})
+
+    first, last = serial_range(request.args.get('from'), request.args.get('to'))
+    if not first or not last:
+        return jsonify({'error': "Pass ?prefix=, or both ?from= and ?to=."}), 400
+    count = db.execute("SELECT COUNT(*) FROM stock WHERE serial_number BETWEEN ? AND ?",
+                       (first, last)).fetchone()[0]
+    rows = db.execute(select + """
+        WHERE s.serial_number BETWEEN ? AND ?
+        ORDER BY s.serial_number
+        LIMIT ?
+    """, (first, last, limit)).fetchall()
+    return jsonify({'from': first, 'to': last, 'count': count,
+                    'serials': [dict(r) for r in rows],
+                    'stock_url': url_for('manage_stock', serial_from=first, serial_to=last)})
 
 # --- STOCK CRUD OPERATIONS ---
 
@@ -592,11 +1187,10 @@ def add_stock():
         mfg_date = request.form.get('mfg_date')
         
         try:
-            db.execute("""
+            db_writer.execute("""
                 INSERT INTO stock (fixture_id, serial_number, warehouse_id, mfg_date, status)
-                VALUES (?, ?, ?, ?, 'FOR SALE')
-            """, (fixture_id, serial_number, warehouse_id, mfg_date))
-            db.commit()
+                VALUES (?, ?, ?, ?, ?)
+            """, (fixture_id, serial_number, warehouse_id, mfg_date, statuses.DEFAULT))
             flash(f"Unit {serial_number} added to inventory.", "success")
             return redirect(url_for('manage_stock'))
         except sqlite3.IntegrityError:
@@ -608,11 +1202,195 @@ def add_stock():
 
 # 1.2 ADD BULK STOCK
 
+# Rows staged per executemany call while loading an upload
+IMPORT_BATCH_SIZE = 5000
+
+
+def save_upload(file):
+    """Store an upload for a background job and return its path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.csv")
+    file.save(path)
+    return path
+
+
+def job_accepted(job_id, message):
+    """Answer an upload: job JSON for API clients, else back to /stock to watch it."""
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        response = jsonify(job_json(jobs.get(get_db(), job_id)))
+        response.status_code = 202
+        response.headers['Location'] = url_for('job_status', id=job_id)
+        return response
+    flash(message, "info")
+    return redirect(url_for('manage_stock', job=job_id))
+
+
+def dry_run_report(title, file, check, *args):
+    """
+    Answer a "Validate only" upload: run `check(db, stream, *args)` from
+    precheck on the file and show the rows the import would reject.
+    Nothing is saved or written.
+    """
+    try:
+        result = check(get_db(), file.stream, *args)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(request.referrer or url_for('add_stock'))
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify({'dry_run': True, 'filename': file.filename, **result})
+    return render_template('import_report.html', title=f"{title} (Dry Run)", filename=file.filename,
+                           summary=result['summary'], problems=result['problems'], dry_run=True)
+
+
+def begin_write(db):
+    """
+    Take the write lock before an import's first read of the main database.
+
+    Staging only touched temp tables, so its transaction is committed first.
+    A deferred transaction that reads stock and then writes cannot upgrade
+    to a write if another connection committed in between: SQLite fails it
+    with SQLITE_BUSY_SNAPSHOT, which busy_timeout doesn't retry. BEGIN
+    IMMEDIATE takes the snapshot and the lock together, waiting for the lock
+    if need be.
+    """
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN IMMEDIATE")
+
+
+def stage_dates(batch, columns, problems):
+    """
+    Normalize the raw date fields of a staging batch, one column at a time.
+
+    `batch` holds row tuples starting (row_idx, serial_number, ...) and
+    `columns` maps a position in those tuples to its dates.DateColumn.
+    Rows with a date no format can read are added to `problems` and left
+    out; the rest are returned with their dates as YYYY-MM-DD.
+    """
+    rows = [list(r) for r in batch]
+    unreadable = {}
+    for position, column in columns.items():
+        raw = [r[position] for r in rows]
+        converted, failed = column.convert(raw)
+        for r, value in zip(rows, converted):
+            r[position] = value
+        for i in failed:
+            unreadable.setdefault(i, []).append(f"{column.name} '{raw[i].strip()}'")
+    for i in sorted(unreadable):
+        problems.append({'row': rows[i][0], 'serial_number': rows[i][1],
+                         'error': f"Unrecognized date: {', '.join(unreadable[i])}."})
+    return [tuple(r) for i, r in enumerate(rows) if i not in unreadable]
+
+
+def date_format_notes(columns):
+    """{column name: format it was read in} for the import summary."""
+    return {c.name: c.describe() for c in columns.values() if c.describe()}
+
+
+def import_new_units(db, stream, fixture_id, warehouse_id, batch_size=IMPORT_BATCH_SIZE, progress=None,
+                     before_commit=None):
+    """
+    Insert new units from a CSV stream (header: serial_number[, mfg_date]).
+
+    The file is staged into a temp table in fixed-size batches, duplicate
+    serials are found with set queries (within the file, and against the
+    serial_number UNIQUE index), and every clean row is inserted with one
+    INSERT ... SELECT. The main database is write-locked from the first of
+    those queries (see begin_write), not while the file is being read. The
+    first occurrence of a serial repeated in the file is imported; later
+    ones are reported.
+
+    mfg_date is normalized column-wise (see dates.DateColumn); rows whose
+    date can't be read are reported, not imported.
+
+    `progress(rows_read, problems_so_far)` is called after every batch, and
+    `before_commit(db)`, if given, runs inside the import's transaction.
+
+    Returns {'imported': n, 'problems': [{'row', 'serial_number', 'error'}, ...],
+    'date_formats': {column: how it was read}}.
+    Raises ValueError if the CSV lacks the required header.
+    """
+    reader = csv.DictReader(stream)
+    required_headers = {'serial_number'}
+    if not required_headers.issubset(set(reader.fieldnames or [])):
+        raise ValueError(f"Invalid CSV format. Required headers: {', '.join(required_headers)}")
+
+    problems = []
+    db.execute("DROP TABLE IF EXISTS temp.import_rows")
+    db.execute("""
+        CREATE TEMP TABLE import_rows (
+            row_idx INTEGER PRIMARY KEY,
+            serial_number TEXT NOT NULL,
+            mfg_date TEXT
+        )
+    """)
+
+    date_columns = {2: dates.DateColumn('mfg_date')}
+    batch = []
+    for row_idx, row in enumerate(reader, start=2):
+        sn = (row.get('serial_number') or '').strip()
+        if not sn:
+            problems.append({'row': row_idx, 'serial_number': '', 'error': "Serial number is empty."})
+            continue
+        batch.append((row_idx, sn, row.get('mfg_date') or ''))
+        if len(batch) >= batch_size:
+            db.executemany("INSERT INTO import_rows VALUES (?, ?, ?)", stage_dates(batch, date_columns, problems))
+            batch = []
+            if progress:
+                progress(row_idx - 1, len(problems))
+    if batch:
+        db.executemany("INSERT INTO import_rows VALUES (?, ?, ?)", stage_dates(batch, date_columns, problems))
+    if progress:
+        progress(max(reader.line_num - 1, 0), len(problems))
+
+    db.execute("CREATE INDEX temp.idx_import_rows_serial ON import_rows (serial_number, row_idx)")
+    begin_write(db)
+
+    # Repeats within the file (every occurrence after the first)
+    for r in db.execute("""
+        SELECT i.row_idx, i.serial_number
+        FROM import_rows i
+        WHERE EXISTS (SELECT 1 FROM import_rows e
+                      WHERE e.serial_number = i.serial_number AND e.row_idx < i.row_idx)
+    """):
+        problems.append({'row': r['row_idx'], 'serial_number': r['serial_number'],
+                         'error': "Serial Number repeated earlier in this file."})
+
+    # Collisions with units already registered
+    for r in db.execute("""
+        SELECT i.row_idx, i.serial_number
+        FROM import_rows i
+        JOIN stock s ON s.serial_number = i.serial_number
+    """):
+        problems.append({'row': r['row_idx'], 'serial_number': r['serial_number'],
+                         'error': f"Serial Number '{r['serial_number']}' already exists."})
+
+    cursor = db.execute("""
+        INSERT INTO stock (fixture_id, serial_number, warehouse_id, mfg_date, status)
+        SELECT ?, i.serial_number, ?, i.mfg_date, ?
+        FROM import_rows i
+        WHERE NOT EXISTS (SELECT 1 FROM import_rows e
+                          WHERE e.serial_number = i.serial_number AND e.row_idx < i.row_idx)
+          AND NOT EXISTS (SELECT 1 FROM stock s WHERE s.serial_number = i.serial_number)
+        ORDER BY i.row_idx
+    """, (fixture_id, warehouse_id, statuses.DEFAULT))
+    imported = cursor.rowcount
+    if before_commit:
+        before_commit(db)
+    db.commit()
+    db.execute("DROP TABLE IF EXISTS temp.import_rows")
+
+    problems.sort(key=lambda p: p['row'])
+    return {'imported': imported, 'problems': problems, 'date_formats': date_format_notes(date_columns)}
+
+
 @app.route('/stock/bulk-upload', methods=['POST'])
 def bulk_upload_stock():
     """
     Handles bulk insertion of stock units via CSV.
     Transforms manufacturing dates into database-friendly format.
+    The import runs as a background job; see /jobs/<id> for progress.
+    With dry_run set, the file is only validated (see precheck.py).
     """
     if 'file' not in request.files:
         flash("No file part in the request.", "danger")
@@ -630,60 +1408,12 @@ def bulk_upload_stock():
         flash("No file selected.", "danger")
         return redirect(url_for('add_stock'))
 
-    try:
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.DictReader(stream)
-        
-        required_headers = {'serial_number'}
-        if not required_headers.issubset(set(reader.fieldnames)):
-            flash(f"Invalid CSV format. Required headers: {', '.join(required_headers)}", "danger")
-            return redirect(url_for('add_stock'))
-
-        db = get_db()
-        import_count = 0
-        errors = []
-
-        try:
-            for row_idx, row in enumerate(reader, start=2):
-                try:
-                    sn = row['serial_number'].strip()
-                    raw_mfg = row.get('mfg_date', '').strip()
-                    
-                    # Transform the date format automatically
-                    standardized_mfg = parse_date(raw_mfg)
-
-                    if not sn:
-                        errors.append(f"Row {row_idx}: Serial number is empty.")
-                        continue
-
-                    db.execute("""
-                        INSERT INTO stock (fixture_id, serial_number, warehouse_id, mfg_date, status)
-                        VALUES (?, ?, ?, ?, 'FOR SALE')
-                    """, (selected_fixture_id, sn, selected_warehouse_id, standardized_mfg))
-                    import_count += 1
-                    
-                except sqlite3.IntegrityError:
-                    errors.append(f"Row {row_idx}: Serial Number '{sn}' already exists.")
-                except Exception as e:
-                    errors.append(f"Row {row_idx}: {str(e)}")
-
-            db.commit()
-            
-            if errors:
-                flash(f"Imported {import_count} units. {len(errors)} rows had errors.", "warning")
-                for err in errors[:3]:
-                    flash(err, "danger")
-            else:
-                flash(f"Successfully imported {import_count} units.", "success")
-
-        except Exception as e:
-            db.rollback()
-            flash(f"Database error: {str(e)}", "danger")
-
-    except Exception as e:
-        flash(f"File processing error: {str(e)}", "danger")
-
-    return redirect(url_for('manage_stock'))
+    if request.form.get('dry_run'):
+        return dry_run_report("Bulk Import Report", file, precheck.check_new_units,
+                              selected_fixture_id, selected_warehouse_id)
+    job_id = jobs.submit('stock_import', save_upload(file), file.filename,
+                         {'fixture_id': selected_fixture_id, 'warehouse_id': selected_warehouse_id})
+    return job_accepted(job_id, f"Import of '{file.filename}' started in the background.")
 
 # 2. EDIT STOCK
 
@@ -693,12 +1423,16 @@ def edit_stock(id):
     db = get_db()
     if request.method == 'POST':
         # Update logic including movement between warehouse and client
-        status = request.form.get('status')
+        status = statuses.normalize_status(request.form.get('status'))
         warehouse_id = request.form.get('warehouse_id') or None
         client_id = request.form.get('client_id') or None
         install_date = request.form.get('install_date') or None
+
+        if status is None:
+            flash(f"Unknown status '{request.form.get('status')}'.", "danger")
+            return redirect(url_for('edit_stock', id=id))
         
-        db.execute("""
+        db_writer.execute("""
             UPDATE stock SET 
                 status = ?, 
                 warehouse_id = ?, 
@@ -706,7 +1440,6 @@ def edit_stock(id):
                 install_date = ?
             WHERE id = ?
         """, (status, warehouse_id, client_id, install_date, id))
-        db.commit()
         flash("Unit status updated.", "success")
         return redirect(url_for('manage_stock'))
 
@@ -714,78 +1447,574 @@ def edit_stock(id):
     fixtures = db.execute("SELECT id, name FROM fixtures").fetchall()
     warehouses = db.execute("SELECT id, name FROM warehouses").fetchall()
     clients = db.execute("SELECT id, name FROM clients").fetchall()
+    status_list = db.execute("SELECT code, label FROM statuses ORDER BY rowid").fetchall()
     
     return render_template('edit_stock.html', 
                            stock=stock, 
                            fixtures=fixtures, 
                            warehouses=warehouses, 
                            clients=clients, 
+                           statuses=status_list,
                            action="Edit")
 
-def parse_date(date_str):
-    """Utility to normalize date strings to YYYY-MM-DD."""
-    if not date_str or not date_str.strip():
-        return None
-    date_str = date_str.strip()
-    formats = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%Y/%m/%d']
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-        except ValueError:
+# 2.1 BATCH STATUS TRANSITIONS
+
+# Marks a batch field the request leaves unchanged (None means "clear it")
+KEEP = object()
+
+# Target statuses that only make sense with a location (by status category)
+BATCH_NEEDS_WAREHOUSE = statuses.codes_in('in_stock')
+BATCH_NEEDS_CLIENT = statuses.codes_in('sold') + statuses.codes_in('deployed')
+
+
+def batch_transition(db, ids, serials, serial_from, serial_to, changes):
+    """
+    Apply one status/location change to a set of units with a single UPDATE.
+
+    Units are named by stock id, by serial, and/or by an inclusive serial
+    run. They are staged into a temp table and validated as a set. A unit
+    that is not found, named twice, or that would end up without the
+    warehouse (in-stock statuses) or client (sold/installed) its new
+    status needs is reported and skipped; the rest are updated together.
+
+    `changes` maps status (required), warehouse_id, client_id and
+    install_date to their new values; a missing or KEEP field is left as
+    is. Runs inside the caller's transaction (db_writer).
+
+    Returns {'updated': n, 'problems': [{'unit', 'error'}, ...]}.
+    """
+    problems = []
+    db.execute("DROP TABLE IF EXISTS temp.batch_units")
+    db.execute("""
+        CREATE TEMP TABLE batch_units (
+            pos INTEGER PRIMARY KEY,
+            ref TEXT NOT NULL,          -- what the request named the unit by
+            stock_id INTEGER
+        )
+    """)
+    db.executemany("INSERT INTO batch_units (ref, stock_id) SELECT ?, id FROM stock WHERE id = ?",
+                   [(f"#{i}", i) for i in ids])
+    db.executemany("INSERT INTO batch_units (ref, stock_id) SELECT ?, id FROM stock WHERE serial_number = ?",
+                   [(sn, sn) for sn in serials])
+    found = db.execute("SELECT ref FROM batch_units").fetchall()
+    missing = set([f"#{i}" for i in ids] + list(serials)) - {r['ref'] for r in found}
+    for ref in sorted(missing):
+        problems.append({'unit': ref, 'error': "Unit not found."})
+    if serial_from and serial_to:
+        run = db.execute("""
+            INSERT INTO batch_units (ref, stock_id)
+            SELECT serial_number, id FROM stock WHERE serial_number BETWEEN ? AND ?
+        """, (serial_from, serial_to)).rowcount
+        if not run:
+            problems.append({'unit': f"{serial_from} .. {serial_to}", 'error': "No units in this serial range."})
+
+    # The same unit named twice (e.g. by id and inside the range) is applied once
+    db.execute("CREATE INDEX temp.idx_batch_units_stock ON batch_units (stock_id, pos)")
+    db.execute("""
+        DELETE FROM batch_units
+        WHERE EXISTS (SELECT 1 FROM batch_units e WHERE e.stock_id = batch_units.stock_id AND e.pos < batch_units.pos)
+    """)
+
+    # Where each unit would end up, to check it against the new status
+    final_warehouse = "s.warehouse_id" if changes.get('warehouse_id', KEEP) is KEEP else "?"
+    final_client = "s.client_id" if changes.get('client_id', KEEP) is KEEP else "?"
+    checks = [
+        (BATCH_NEEDS_WAREHOUSE, final_warehouse, changes.get('warehouse_id'), "needs a warehouse"),
+        (BATCH_NEEDS_CLIENT, final_client, changes.get('client_id'), "needs a client"),
+    ]
+    for codes, column, value, reason in checks:
+        if changes['status'] not in codes:
             continue
-    return date_str
+        params = () if column != "?" else (value,)
+        for r in db.execute(f"""
+            SELECT s.serial_number FROM batch_units b JOIN stock s ON s.id = b.stock_id
+            WHERE {column} IS NULL
+        """, params).fetchall():
+            problems.append({'unit': r['serial_number'],
+                             'error': f"Status {changes['status']} {reason}; unit left unchanged."})
+        db.execute(f"""
+            DELETE FROM batch_units
+            WHERE stock_id IN (SELECT s.id FROM batch_units b JOIN stock s ON s.id = b.stock_id
+                               WHERE {column} IS NULL)
+        """, params)
+
+    sets, params = ["status = ?"], [changes['status']]
+    for column in ('warehouse_id', 'client_id', 'install_date'):
+        if changes.get(column, KEEP) is not KEEP:
+            sets.append(f"{column} = ?")
+            params.append(changes[column])
+    updated = db.execute(f"""
+        UPDATE stock SET {', '.join(sets)}
+        WHERE id IN (SELECT stock_id FROM batch_units)
+    """, params).rowcount
+    db.execute("DROP TABLE temp.batch_units")
+    return {'updated': updated, 'problems': problems}
+
+
+def json_list(data, key):
+    """
+    data[key] from a JSON body as a list of numbers and strings ([] if
+    missing or null). Raises ValueError for any other shape, so a string is
+    never iterated character by character.
+    """
+    value = data.get(key)
+    if value is None:
+        return []
+    if not isinstance(value, list) or any(isinstance(v, bool) or not isinstance(v, (int, str)) for v in value):
+        raise ValueError(f"'{key}' must be a list of numbers or strings.")
+    return value
+
+
+def batch_request_values():
+    """
+    Read a batch transition from JSON or form data.
+
+    Returns (ids, serials, serial_from, serial_to, changes). In JSON a
+    missing field is kept and null clears it; in forms an empty value is
+    kept and "none" clears it. Raises ValueError for an unusable request.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError("Send a JSON object.")
+        ids = json_list(data, 'ids')
+        serials = json_list(data, 'serials')
+        for key in ('serial_from', 'serial_to', 'status'):
+            if not isinstance(data.get(key), (str, type(None))):
+                raise ValueError(f"'{key}' must be a string.")
+        raw = {k: data[k] for k in ('warehouse_id', 'client_id', 'install_date') if k in data}
+    else:
+        data = request.form
+        ids = data.getlist('ids')
+        serials = data.getlist('serials')
+        if len(serials) == 1:
+            # Pasted list: one serial per line, or separated by commas/spaces
+            serials = re.split(r'[\s,;]+', serials[0])
+        raw = {}
+        for k in ('warehouse_id', 'client_id', 'install_date'):
+            value = (data.get(k) or '').strip()
+            if value:
+                raw[k] = None if value.lower() == 'none' else value
+
+    try:
+        ids = [int(i) for i in ids if str(i).strip()]
+    except ValueError:
+        raise ValueError("Stock ids must be whole numbers.")
+    serials = list(dict.fromkeys(str(sn).strip() for sn in serials if str(sn).strip()))
+    serial_from, serial_to = serial_range(data.get('serial_from'), data.get('serial_to'))
+    if bool(serial_from) != bool(serial_to):
+        raise ValueError("A serial range needs both a first and a last serial.")
+    if not ids and not serials and not serial_from:
+        raise ValueError("No units selected.")
+
+    status = statuses.normalize_status(data.get('status'))
+    if status is None:
+        raise ValueError(f"Unknown status '{data.get('status')}'.")
+    changes = {'status': status}
+    for column, value in raw.items():
+        if column == 'install_date':
+            changes[column] = dates.parse_date(value) if value else None
+        else:
+            try:
+                changes[column] = int(value) if value is not None else None
+            except (TypeError, ValueError):
+                raise ValueError(f"{column} must be a whole number or null.")
+    return ids, serials, serial_from, serial_to, changes
+
+
+@app.route('/stock/batch-update', methods=['POST'])
+def batch_update_stock():
+    """
+    Move many units to a new status/location in one request and one
+    transaction. Accepts form data (the multi-select on /stock) or JSON:
+
+        {"serials": [...], "ids": [...], "serial_from": "...", "serial_to": "...",
+         "status": "SOLD", "client_id": 3, "warehouse_id": null, "install_date": "2024-05-01"}
+    """
+    wants_json = request.is_json
+    back = url_for('manage_stock')
+    if not wants_json and (request.form.get('next') or '').startswith(back):
+        back = request.form['next']
+
+    try:
+        ids, serials, serial_from, serial_to, changes = batch_request_values()
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), "danger")
+        return redirect(back)
 
-@app.route('/stock/export-csv')
-def export_stock_csv():
-    """Generates a CSV of all current stock for bulk editing."""
     db = get_db()
-    stocks = db.execute("""
-        SELECT 
-            s.serial_number, 
-            f.name as fixture_name, 
-            s.status, 
-            s.mfg_date,
-            w.name as warehouse_name,
-            c.name as client_name,
-            s.install_date
-        FROM stock s
-        JOIN fixtures f ON s.fixture_id = f.id
-        LEFT JOIN warehouses w ON s.warehouse_id = w.id
-        LEFT JOIN clients c ON s.client_id = c.id
-    """).fetchall()
+    for column, table in (('warehouse_id', 'warehouses'), ('client_id', 'clients')):
+        value = changes.get(column)
+        if value is not None and db.execute(f"SELECT 1 FROM {table} WHERE id = ?", (value,)).fetchone() is None:
+            message = f"No {table[:-1]} with id {value}."
+            if wants_json:
+                return jsonify({'error': message}), 400
+            flash(message, "danger")
+            return redirect(back)
+
+    result = db_writer.run(lambda wdb: batch_transition(wdb, ids, serials, serial_from, serial_to, changes))
+    if wants_json:
+        return jsonify(result)
+
+    flash(f"{result['updated']} unit(s) moved to {statuses.LABELS.get(changes['status'], changes['status'])}.",
+          "success" if result['updated'] else "warning")
+    if result['problems']:
+        shown = "; ".join(f"{p['unit']}: {p['error']}" for p in result['problems'][:10])
+        more = len(result['problems']) - 10
+        flash(f"{len(result['problems'])} unit(s) skipped. {shown}" + (f" (and {more} more)" if more > 0 else ""),
+              "warning")
+    return redirect(back)
+
+# Column -> SQL for the export query
+EXPORT_SQL = {
+    'id': 's.id',
+    'serial_number': 's.serial_number',
+    'fixture_id': 's.fixture_id',
+    'fixture_name': 'f.name',
+    'status': 's.status',
+    'mfg_date': 's.mfg_date',
+    'warehouse_id': 's.warehouse_id',
+    'warehouse_name': 'w.name',
+    'client_id': 's.client_id',
+    'client_name': 'c.name',
+    'install_date': 's.install_date',
+}
+# The CSV is the file /stock/bulk-update-csv takes back, so it keeps to names
+EXPORT_COLUMNS = ['serial_number', 'fixture_name', 'status', 'mfg_date', 'warehouse_name', 'client_name', 'install_date']
+# Parquet and Arrow carry the ids too, each column in its own Arrow type
+COLUMNAR_TYPES = {
+    'id': 'int64', 'serial_number': 'string', 'fixture_id': 'int64', 'fixture_name': 'string',
+    'status': 'string', 'mfg_date': 'date32', 'warehouse_id': 'int64', 'warehouse_name': 'string',
+    'client_id': 'int64', 'client_name': 'string', 'install_date': 'date32',
+}
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+# Rows pulled from the cursor per fetchmany / Parquet row group
+EXPORT_BATCH_SIZE = 10000
+# Flush the CSV buffer to the client once it holds this many characters
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def iter_export_batches(columns):
+    """
+    Yield lists of export rows (`columns`, see EXPORT_SQL) straight off a
+    cursor, EXPORT_BATCH_SIZE at a time.
 
-    def generate():
-        data = io.StringIO()
-        writer = csv.writer(data)
-        # Headers
-        writer.writerow(['serial_number', 'fixture_name', 'status', 'mfg_date', 'warehouse_name', 'client_name', 'install_date'])
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-
-        for s in stocks:
-            writer.writerow([
-                s['serial_number'], 
-                s['fixture_name'], 
-                s['status'], 
-                s['mfg_date'],
-                s['warehouse_name'] or '',
-                s['client_name'] or '',
-                s['install_date'] or ''
-            ])
+    Uses its own connection because the response body is produced after the
+    request (and its get_db() connection) has already been torn down.
+    """
+    db = watched(_trace(database.connect(readonly=True)), 'export_stock_csv')
+    try:
+        cursor = db.execute(f"""
+            SELECT {', '.join(f'{EXPORT_SQL[c]} AS {c}' for c in columns)}
+            FROM stock s
+            JOIN fixtures f ON s.fixture_id = f.id
+            LEFT JOIN warehouses w ON s.warehouse_id = w.id
+            LEFT JOIN clients c ON s.client_id = c.id
+        """)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield [tuple(r) for r in rows]
+    finally:
+        db.close()
+
+
+def generate_csv():
+    data = io.StringIO()
+    writer = csv.writer(data)
+    # Headers go out before the query runs, so the first byte is immediate
+    writer.writerow(EXPORT_COLUMNS)
+    yield data.getvalue()
+    data.seek(0)
+    data.truncate(0)
+
+    for batch in iter_export_batches(EXPORT_COLUMNS):
+        writer.writerows([['' if v is None else v for v in row] for row in batch])
+        if data.tell() >= EXPORT_CHUNK_SIZE:
             yield data.getvalue()
             data.seek(0)
             data.truncate(0)
+    if data.tell():
+        yield data.getvalue()
+
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        out = compressor.compress(chunk.encode('utf-8'))
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that collects bytes until the caller drains them."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        out = b''.join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def generate_columnar(fmt, pa):
+    """
+    Stream the export as Parquet (one row group per batch) or an Arrow IPC
+    stream (one record batch per batch), draining bytes after every write.
+    Columns are typed as in COLUMNAR_TYPES; dates are read from their
+    stored YYYY-MM-DD form, and one that isn't (no write path stores such
+    a value) comes out null.
+    """
+    import pyarrow.compute as pc
+    names = list(COLUMNAR_TYPES)
+    schema = pa.schema([(name, getattr(pa, COLUMNAR_TYPES[name])()) for name in names])
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    for batch in iter_export_batches(names):
+        columns = []
+        for field, values in zip(schema, zip(*batch)):
+            if field.type == pa.date32():
+                text = pa.array(values, pa.string())
+                columns.append(pc.strptime(text, format='%Y-%m-%d', unit='s', error_is_null=True)
+                               .cast(pa.date32()))
+            else:
+                columns.append(pa.array(values, field.type))
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+@app.route('/stock/export-csv')
+@conditional_get
+def export_stock_csv():
+    """
+    Streams all current stock for bulk editing or analysis.
+
+    ?format=csv (default), parquet or arrow; ?gzip=1 compresses CSV on the
+    fly. Rows are read from the cursor in batches, so memory stays flat and
+    the first byte goes out before the query has finished. Any other format
+    is a 400.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description=f"Unknown export format '{fmt}'. Supported formats: {', '.join(EXPORT_FORMATS)}.")
+
+    if fmt in ('parquet', 'arrow'):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            flash("Parquet/Arrow export needs the pyarrow package installed on the server.", "danger")
+            return redirect(url_for('manage_stock'))
+        extension, mimetype = {
+            'parquet': ('parquet', 'application/vnd.apache.parquet'),
+            'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+        }[fmt]
+        return Response(
+            generate_columnar(fmt, pa),
+            mimetype=mimetype,
+            headers={"Content-disposition": f"attachment; filename=lumi_stock_export.{extension}"}
+        )
+
+    if request.args.get('gzip'):
+        return Response(
+            gzip_stream(generate_csv()),
+            mimetype='application/gzip',
+            headers={"Content-disposition": "attachment; filename=lumi_stock_export.csv.gz"}
+        )
 
     return Response(
-        generate(),
+        generate_csv(),
         mimetype='text/csv',
         headers={"Content-disposition": "attachment; filename=lumi_stock_export.csv"}
     )
 
+def update_units_from_csv(db, stream, batch_size=IMPORT_BATCH_SIZE, progress=None, before_commit=None):
+    """
+    Apply an edited stock export (matched on serial_number) in a few set
+    statements.
+
+    The CSV is staged into a temp table; unknown serials and fixtures are
+    found with anti-joins; missing warehouses and clients are each created
+    with one INSERT ... SELECT DISTINCT; then stock is updated with a single
+    UPDATE ... FROM join. The main database is write-locked from the
+    anti-joins on (see begin_write), not while the file is being read. If a
+    serial appears more than once, its last row wins and the earlier ones
+    are reported. Dates are normalized column-wise (see dates.DateColumn);
+    rows with a date that can't be read are reported.
+
+    `progress(rows_read, problems_so_far)` is called after every batch, and
+    `before_commit(db)`, if given, runs inside the update's transaction.
+
+    Returns {'updated', 'new_warehouses', 'new_clients', 'problems', 'date_formats'}.
+    Raises ValueError if required columns are missing.
+    """
+    reader = csv.DictReader(stream)
+
+    # Required headers for matching and updating
+    required = {'serial_number', 'status'}
+    if not required.issubset(set(reader.fieldnames or [])):
+        raise ValueError(f"CSV missing required columns: {required}")
+
+    problems = []
+    db.execute("DROP TABLE IF EXISTS temp.update_rows")
+    db.execute("""
+        CREATE TEMP TABLE update_rows (
+            row_idx INTEGER PRIMARY KEY,
+            serial_number TEXT NOT NULL,
+            status TEXT NOT NULL,
+            mfg_date TEXT,
+            install_date TEXT,
+            warehouse_name TEXT,
+            client_name TEXT,
+            fixture_name TEXT,
+            warehouse_id INTEGER,
+            client_id INTEGER,
+            fixture_id INTEGER
+        )
+    """)
+
+    date_columns = {3: dates.DateColumn('mfg_date'), 4: dates.DateColumn('install_date')}
+    batch = []
+    insert_sql = """
+        INSERT INTO update_rows (row_idx, serial_number, status, mfg_date, install_date,
+                                 warehouse_name, client_name, fixture_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    for row_idx, row in enumerate(reader, start=2):
+        sn = (row.get('serial_number') or '').strip()
+        if not sn:
+            continue
+        new_status = statuses.normalize_status(row.get('status'))
+        if new_status is None:
+            problems.append({'row': row_idx, 'serial_number': sn,
+                             'error': f"Unknown status '{row.get('status')}'."})
+            continue
+        batch.append((
+            row_idx, sn, new_status,
+            row.get('mfg_date') or '',
+            row.get('install_date') or '',
+            (row.get('warehouse_name') or '').strip() or None,
+            (row.get('client_name') or '').strip() or None,
+            (row.get('fixture_name') or '').strip() or None,
+        ))
+        if len(batch) >= batch_size:
+            db.executemany(insert_sql, stage_dates(batch, date_columns, problems))
+            batch = []
+            if progress:
+                progress(row_idx - 1, len(problems))
+    if batch:
+        db.executemany(insert_sql, stage_dates(batch, date_columns, problems))
+    if progress:
+        progress(max(reader.line_num - 1, 0), len(problems))
+
+    db.execute("CREATE INDEX temp.idx_update_rows_serial ON update_rows (serial_number, row_idx)")
+    begin_write(db)
+
+    # Anti-joins: rows that can't be applied. Each check's rows are reported
+    # and dropped from staging before the next check runs, so a repeated
+    # serial only supersedes an earlier row if the later one is valid.
+    checks = [
+        ("Serial '{serial_number}' not found.", """
+            SELECT u.row_idx, u.serial_number, NULL AS detail FROM update_rows u
+            WHERE NOT EXISTS (SELECT 1 FROM stock s WHERE s.serial_number = u.serial_number)
+        """),
+        ("Fixture '{detail}' not found.", """
+            SELECT u.row_idx, u.serial_number, u.fixture_name AS detail FROM update_rows u
+            WHERE u.fixture_name IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM fixtures f WHERE f.name = u.fixture_name)
+        """),
+        ("Serial '{serial_number}' appears again on row {detail}, which takes precedence.", """
+            SELECT u.row_idx, u.serial_number, MIN(l.row_idx) AS detail FROM update_rows u
+            JOIN update_rows l ON l.serial_number = u.serial_number AND l.row_idx > u.row_idx
+            GROUP BY u.row_idx
+        """),
+    ]
+    for message, sql in checks:
+        rejected = []
+        for r in db.execute(sql).fetchall():
+            problems.append({'row': r['row_idx'], 'serial_number': r['serial_number'],
+                             'error': message.format(serial_number=r['serial_number'], detail=r['detail'])})
+            rejected.append((r['row_idx'],))
+        db.executemany("DELETE FROM update_rows WHERE row_idx = ?", rejected)
+
+    # 1. Create missing warehouses and clients in one statement each
+    new_warehouses = db.execute("""
+        INSERT INTO warehouses (name)
+        SELECT DISTINCT u.warehouse_name FROM update_rows u
+        WHERE u.warehouse_name IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM warehouses w WHERE w.name = u.warehouse_name)
+    """).rowcount
+    new_clients = db.execute("""
+        INSERT INTO clients (name)
+        SELECT DISTINCT u.client_name FROM update_rows u
+        WHERE u.client_name IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM clients c WHERE c.name = u.client_name)
+    """).rowcount
+
+    # 2. Resolve names to ids (first match, as the row-by-row lookup did)
+    db.execute("""
+        UPDATE update_rows SET
+            warehouse_id = (SELECT MIN(w.id) FROM warehouses w WHERE w.name = update_rows.warehouse_name),
+            client_id = (SELECT MIN(c.id) FROM clients c WHERE c.name = update_rows.client_name),
+            fixture_id = (SELECT MIN(f.id) FROM fixtures f WHERE f.name = update_rows.fixture_name)
+    """)
+
+    # 3. Perform update
+    updated = db.execute("""
+        UPDATE stock SET 
+            status = u.status, 
+            mfg_date = COALESCE(u.mfg_date, stock.mfg_date), 
+            install_date = u.install_date, 
+            warehouse_id = u.warehouse_id, 
+            client_id = u.client_id, 
+            fixture_id = COALESCE(u.fixture_id, stock.fixture_id)
+        FROM update_rows u
+        WHERE stock.serial_number = u.serial_number
+    """).rowcount
+    if before_commit:
+        before_commit(db)
+    db.commit()
+    db.execute("DROP TABLE IF EXISTS temp.update_rows")
+
+    problems.sort(key=lambda p: p['row'])
+    return {'updated': updated, 'new_warehouses': new_warehouses,
+            'new_clients': new_clients, 'problems': problems,
+            'date_formats': date_format_notes(date_columns)}
+
+
 @app.route('/stock/bulk-update-csv', methods=['POST'])
 def bulk_update_stock_csv():
-    """Processes a CSV to update stock. Automatically creates missing Clients/Warehouses."""
+    """Processes a CSV to update stock. Automatically creates missing Clients/Warehouses.
+
+    Runs as a background job; see /jobs/<id> for progress. With dry_run
+    set, the file is only validated (see precheck.py).
+    """
     if 'file' not in request.files:
         flash("No file provided.", "danger")
         return redirect(url_for('manage_stock'))
@@ -795,187 +2024,187 @@ def bulk_update_stock_csv():
         flash("No file selected.", "danger")
         return redirect(url_for('manage_stock'))
 
-    try:
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.DictReader(stream)
-        
-        db = get_db()
-        update_count = 0
-        new_clients = 0
-        new_warehouses = 0
-        errors = []
-
-        # Required headers for matching and updating
-        required = {'serial_number', 'status'}
-        if not required.issubset(set(reader.fieldnames)):
-            flash(f"CSV missing required columns: {required}", "danger")
-            return redirect(url_for('manage_stock'))
-
-        for row_idx, row in enumerate(reader, start=2):
-            sn = row['serial_number'].strip()
-            new_status = row['status'].strip().upper()
-            raw_mfg = row.get('mfg_date', '').strip()
-            raw_install = row.get('install_date', '').strip()
-            w_name = row.get('warehouse_name', '').strip()
-            c_name = row.get('client_name', '').strip()
-            f_name = row.get('fixture_name', '').strip()
-            
-            if not sn:
-                continue
-
-            # Check if stock unit exists
-            unit = db.execute("SELECT id FROM stock WHERE serial_number = ?", (sn,)).fetchone()
-            if not unit:
-                errors.append(f"Row {row_idx}: Serial '{sn}' not found.")
-                continue
-
-            # 1. Handle Warehouse (Get or Create)
-            warehouse_id = None
-            if w_name:
-                w_row = db.execute("SELECT id FROM warehouses WHERE name = ?", (w_name,)).fetchone()
-                if w_row:
-                    warehouse_id = w_row['id']
-                else:
-                    # Create new warehouse
-                    cursor = db.execute("INSERT INTO warehouses (name) VALUES (?)", (w_name,))
-                    warehouse_id = cursor.lastrowid
-                    new_warehouses += 1
-
-            # 2. Handle Client (Get or Create)
-            client_id = None
-            if c_name:
-                c_row = db.execute("SELECT id FROM clients WHERE name = ?", (c_name,)).fetchone()
-                if c_row:
-                    client_id = c_row['id']
-                else:
-                    # Create new client
-                    cursor = db.execute("INSERT INTO clients (name) VALUES (?)", (c_name,))
-                    client_id = cursor.lastrowid
-                    new_clients += 1
-
-            # 2.5. Hanndle Fixture Name Verification (Optional)
-            if f_name:
-                f_row = db.execute("SELECT id FROM fixtures WHERE name = ?", (f_name,)).fetchone()
-                if not f_row:
-                    errors.append(f"Row {row_idx}: Fixture '{f_name}' not found.")
-                    continue
-
-            # 3. Normalize dates
-            mfg_date = parse_date(raw_mfg)
-            install_date = parse_date(raw_install)
-
-            # 4. Perform update
-            db.execute("""
-                UPDATE stock SET 
-                    status = ?, 
-                    mfg_date = COALESCE(?, mfg_date), 
-                    install_date = ?, 
-                    warehouse_id = ?, 
-                    client_id = ?, 
-                    fixture_id = ?
-                WHERE serial_number = ?
-            """, (new_status, mfg_date, install_date, warehouse_id, client_id, f_row['id'], sn))
-            
-            update_count += 1
-
-        db.commit()
-        
-        msg = f"Updated {update_count} units."
-        if new_clients > 0 or new_warehouses > 0:
-            msg += f" Created {new_clients} new clients and {new_warehouses} new warehouses."
-        
-        if errors:
-            flash(f"{msg} Some errors occurred.", "warning")
-            for err in errors[:3]: flash(err, "danger") 
-        else:
-            flash(msg, "success")
+    if request.form.get('dry_run'):
+        return dry_run_report("Bulk Update Report", file, precheck.check_updates)
+    job_id = jobs.submit('stock_update', save_upload(file), file.filename)
+    return job_accepted(job_id, f"Update from '{file.filename}' started in the background.")
 
-    except Exception as e:
-        flash(f"Error processing CSV: {str(e)}", "danger")
+# 2.5 IMPORT JOBS
 
-    return redirect(url_for('manage_stock'))
+def finish_import(db):
+    """
+    Snapshot the ledger if due and mark cached results stale, in the
+    import's own transaction: the new rows are never on disk under the
+    old generation.
+    """
+    ledger.maybe_snapshot(db)
+    bump_generation(db, commit=False)
+
+@jobs.runner('stock_import')
+def run_stock_import(db, job, progress):
+    with open(job['file_path'], encoding='utf-8-sig', newline='') as stream:
+        result = import_new_units(db, stream, job['params']['fixture_id'], job['params']['warehouse_id'],
+                                  progress=progress, before_commit=finish_import)
+    summary = {'Imported': result['imported'], 'Rejected rows': len(result['problems'])}
+    summary.update((f"{column} format", read_as) for column, read_as in result['date_formats'].items())
+    return summary, result['problems']
+
+@jobs.runner('stock_update')
+def run_stock_update(db, job, progress):
+    with open(job['file_path'], encoding='utf-8-sig', newline='') as stream:
+        result = update_units_from_csv(db, stream, progress=progress, before_commit=finish_import)
+    summary = {'Updated': result['updated'],
+               'New warehouses': result['new_warehouses'],
+               'New clients': result['new_clients'],
+               'Rows not applied': len(result['problems'])}
+    summary.update((f"{column} format", read_as) for column, read_as in result['date_formats'].items())
+    return summary, result['problems']
+
+def job_json(job):
+    """Public view of a job row (the problem list is served by the report page)."""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'rows_processed': job['rows_processed'],
+        'error_count': job['error_count'],
+        'summary': job['result'],
+        'message': job['message'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'report_url': url_for('job_report', id=job['id']) if job['problems'] else None,
+    }
+
+@app.route('/jobs/<int:id>')
+def job_status(id):
+    """Progress of a background import, polled by the stock page."""
+    job = jobs.get(get_db(), id)
+    if job is None:
+        abort(404)
+    return jsonify(job_json(job))
+
+@app.route('/jobs/<int:id>/report')
+def job_report(id):
+    """Full list of rows a finished import could not apply."""
+    job = jobs.get(get_db(), id)
+    if job is None:
+        abort(404)
+    if job['status'] != 'done':
+        flash(f"Job {id} is {job['status']}.", "info")
+        return redirect(url_for('manage_stock', job=id))
+    return render_template('import_report.html',
+                           title="Bulk Import Report" if job['kind'] == 'stock_import' else "Bulk Update Report",
+                           filename=job['filename'],
+                           summary=job['result'],
+                           problems=job['problems'])
 
 # 3. DELETE STOCK
 
 @app.route('/stock/delete/<int:id>', methods=['POST'])
 def delete_stock(id):
     """Remove a unit from the database."""
-    db = get_db()
-    db.execute("DELETE FROM stock WHERE id = ?", (id,))
-    db.commit()
+    db_writer.execute("DELETE FROM stock WHERE id = ?", (id,))
     flash("Unit removed from inventory.", "success")
     return redirect(url_for('manage_stock'))
 
-# <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< OTHERS <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+# <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< SEARCH <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def search_result_url(hit):
+    """Where a search hit links to."""
+    if hit['kind'] == 'stock':
+        return url_for('edit_stock', id=hit['id'])
+    if hit['kind'] == 'fixture':
+        return url_for('view_fixture', id=hit['id'])
+    if hit['kind'] == 'client':
+        return url_for('view_client', id=hit['id'])
+    return url_for('manage_suppliers')
 
-def parse_date(date_str):
+
+@app.route('/search')
+def search_all():
     """
-    Attempts to parse a date string from various common formats
-    and return a standardized YYYY-MM-DD string.
+    Ranked full-text search over serials, fixture specs, clients and suppliers.
+
+    Every word is matched as a prefix (`?q=IP65 moving 200W`). Answers JSON
+    when asked for it (Accept header or ?format=json), else renders a page.
     """
-    if not date_str or not date_str.strip():
-        return None
-        
-    date_str = date_str.strip()
-    # List of common formats found in CSVs
-    formats = [
-        '%Y-%m-%d',   # 2023-12-31
-        '%d/%m/%Y',   # 31/12/2023
-        '%m/%d/%Y',   # 12/31/2023
-        '%d-%m-%Y',   # 31-12-2023
-        '%Y/%m/%d',   # 2023/12/31
-        '%d %b %Y',   # 31 Dec 2023
-        '%b %d, %Y'   # Dec 31, 2023
-    ]
-    
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-        except ValueError:
-            continue
-    
-    # If no formats match, return original (or handle as error)
-    return date_str
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', SEARCH_LIMIT, type=int), SEARCH_MAX_LIMIT))
+    hits = search.search(get_db(), q, limit) if q else []
+    for hit in hits:
+        hit['url'] = search_result_url(hit)
+
+    wants_json = (request.args.get('format') == 'json' or
+                  request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+    if wants_json:
+        return jsonify({'query': q, 'results': hits})
+    return render_template('search.html', search_q=q, results=hits)
 
 # --------------------------------------------------------------------------------------------------# -------------------------------- INVENTORY MANAGEMENT ROUTES --------------------------------
 # 1. VIEW: All Inventory (Combined)
 @app.route('/inventory')
+@conditional_get
 def inventory():
-    db = get_db()
-    
     # Capture current timestamp
     now = datetime.now()
-    
+
+    return render_template('inventory.html', 
+                           now=now,
+                           title="Inventory",
+                           **cached_result(load_dashboard))
+
+# load_dashboard() keys that only regroup other keys' rows for the template
+DASHBOARD_LOOKUPS = ('split_by_warehouse', 'sales_by_client')
+
+def load_dashboard():
+    """Queries behind /inventory, returned as template context."""
+    db = get_db()
+
+    # The counts below read the trigger-maintained summary tables (see
+    # summaries.py) rather than grouping the whole stock table.
+
+    # Status lists by dashboard category (see statuses.py)
+    in_stock = statuses.codes_in('in_stock')
+    sold = statuses.codes_in('sold')
+    repair = statuses.codes_in('repair')
+    in_logistics = statuses.codes_in('repair', 'transit')
+
     # 1. Global Stats
     # Note: Added 'FOR SALE' to the logic so it counts in Global Stats
-    stats = db.execute("""
+    stats = db.execute(f"""
         SELECT 
-            COUNT(*) as total_units,
-            COALESCE(SUM(CASE WHEN status IN ('In Warehouse', 'FOR SALE') THEN 1 ELSE 0 END), 0) as in_stock,
-            COALESCE(SUM(CASE WHEN status IN ('Sold', 'sold', 'SOLD') THEN 1 ELSE 0 END), 0) as total_sold,
-            COALESCE(SUM(CASE WHEN status IN ('Maintenance', 'Repair', 'MAINTENANCE', 'REPAIR') THEN 1 ELSE 0 END), 0) as in_repair
-        FROM stock
-    """).fetchone()
+            COALESCE(SUM(qty), 0) as total_units,
+            COALESCE(SUM(CASE WHEN status IN ({statuses.placeholders(in_stock)}) THEN qty ELSE 0 END), 0) as in_stock,
+            COALESCE(SUM(CASE WHEN status IN ({statuses.placeholders(sold)}) THEN qty ELSE 0 END), 0) as total_sold,
+            COALESCE(SUM(CASE WHEN status IN ({statuses.placeholders(repair)}) THEN qty ELSE 0 END), 0) as in_repair
+        FROM stock_summary_warehouse
+    """, [*in_stock, *sold, *repair]).fetchone()
 
     # 2. Get Warehouses
     warehouses = db.execute("SELECT * FROM warehouses ORDER BY name ASC").fetchall()
     
     # Updated to include 'FOR SALE' status
-    inventory_split = db.execute("""
+    inventory_split = db.execute(f"""
         SELECT 
             w.id as warehouse_id, 
             f.name as fixture_name, 
             f.model_name, 
-            COUNT(s.id) as qty
-        FROM stock s
-        JOIN fixtures f ON s.fixture_id = f.id
-        JOIN warehouses w ON s.warehouse_id = w.id
-        WHERE s.status IN ('In Warehouse', 'FOR SALE')
+            SUM(sw.qty) as qty
+        FROM stock_summary_warehouse sw
+        JOIN fixtures f ON sw.fixture_id = f.id
+        JOIN warehouses w ON sw.warehouse_id = w.id
+        WHERE sw.status IN ({statuses.placeholders(in_stock)})
         GROUP BY w.id, f.id
-    """).fetchall()
+    """, in_stock).fetchall()
 
     # 3. Logistics & Maintenance Data
-    logistics_data = db.execute("""
+    logistics_data = db.execute(f"""
         SELECT 
             s.status,
             f.name as fixture_name,
@@ -985,55 +2214,581 @@ def inventory():
         FROM stock s
         JOIN fixtures f ON s.fixture_id = f.id
         LEFT JOIN warehouses w ON s.warehouse_id = w.id
-        WHERE UPPER(s.status) IN ('MAINTENANCE', 'IN TRANSIT', 'REPAIR')
+        WHERE s.status IN ({statuses.placeholders(in_logistics)})
         ORDER BY s.status ASC
-    """).fetchall()
+    """, in_logistics).fetchall()
 
     # 4. Sales Breakdown by Client
-    sales_split = db.execute("""
+    sales_split = db.execute(f"""
         SELECT 
             c.id as client_id,
             c.name as client_name,
             f.name as fixture_name,
-            COUNT(s.id) as qty
-        FROM stock s
-        JOIN fixtures f ON s.fixture_id = f.id
-        JOIN clients c ON s.client_id = c.id
-        WHERE UPPER(s.status) = 'SOLD'
-        GROUP BY c.id, f.id
-    """).fetchall()
-
-    sold_to_clients = db.execute("""
+            sc.qty
+        FROM stock_summary_client sc
+        JOIN fixtures f ON sc.fixture_id = f.id
+        JOIN clients c ON sc.client_id = c.id
+        WHERE sc.status IN ({statuses.placeholders(sold)})
+    """, sold).fetchall()
+
+    sold_to_clients = db.execute(f"""
         SELECT DISTINCT c.id, c.name 
         FROM clients c
-        JOIN stock s ON c.id = s.client_id
-        WHERE UPPER(s.status) = 'SOLD'
+        JOIN stock_summary_client sc ON c.id = sc.client_id
+        WHERE sc.status IN ({statuses.placeholders(sold)})
         ORDER BY c.name ASC
-    """).fetchall()
+    """, sold).fetchall()
 
-    under_maintenance_clients = db.execute("""
+    under_maintenance_clients = db.execute(f"""
         SELECT DISTINCT c.id, c.name 
         FROM clients c
-        JOIN stock s ON c.id = s.client_id
-        WHERE UPPER(s.status) = 'MAINTENANCE' OR UPPER(s.status) = 'REPAIR'
+        JOIN stock_summary_client sc ON c.id = sc.client_id
+        WHERE sc.status IN ({statuses.placeholders(repair)})
         ORDER BY c.name ASC
-    """).fetchall()
+    """, repair).fetchall()
+
+    # Rows per warehouse and per client, so each card looks its rows up
+    # instead of scanning every row of the split
+    split_by_warehouse = {}
+    for item in inventory_split:
+        split_by_warehouse.setdefault(item['warehouse_id'], []).append(item)
+    sales_by_client = {}
+    for sale in sales_split:
+        sales_by_client.setdefault(sale['client_id'], []).append(sale)
+
+    return dict(stats=stats, 
+                warehouses=warehouses, 
+                inventory_split=inventory_split,
+                split_by_warehouse=split_by_warehouse,
+                sales_by_client=sales_by_client,
+                logistics_data=logistics_data,
+                sales_split=sales_split,
+                sold_to_clients=sold_to_clients,
+                under_maintenance_clients=under_maintenance_clients)
+
+# <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< METRICS <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Per-endpoint request, SQL and template histograms plus result cache
+    counters, in Prometheus text format. Figures are for this worker process.
+    """
+    cache = result_cache.stats()
+    fragments = fragment_cache.stats()
+    extra = [(f'lumipro_startup_{phase}_seconds', 'gauge', f"Seconds from loading app.py to the end of {phase}",
+              round(seconds, 6)) for phase, seconds in startup_timings.items()]
+    extra += [
+        ('lumipro_result_cache_hits_total', 'counter', "Result cache hits", cache['hits']),
+        ('lumipro_result_cache_misses_total', 'counter', "Result cache misses", cache['misses']),
+        ('lumipro_result_cache_evictions_total', 'counter', "Result cache evictions", cache['evictions']),
+        ('lumipro_result_cache_entries', 'gauge', "Entries in the result cache", cache['size']),
+        ('lumipro_fragment_cache_hits_total', 'counter', "Template fragment cache hits", fragments['hits']),
+        ('lumipro_fragment_cache_misses_total', 'counter', "Template fragment cache misses", fragments['misses']),
+        ('lumipro_fragment_cache_bytes', 'gauge', "Characters of HTML in the fragment cache", fragments['bytes']),
+    ]
+    return Response(metrics.REGISTRY.render(extra), mimetype='text/plain; version=0.0.4')
 
+
+@app.route('/metrics/slow-queries')
+def slow_queries():
+    """
+    The slow-query log grouped by normalized SQL, ranked by total time.
+    Statements whose plan scanned the whole stock table are flagged.
+    Answers JSON when asked for it (Accept header or ?format=json).
+    """
+    report = slow_query_log.report()
+    wants_json = (request.args.get('format') == 'json' or
+                  request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+    if wants_json:
+        return jsonify({'threshold_ms': app.config['SLOW_QUERY_MS'], 'statements': report})
+    return render_template('slow_queries.html', report=report, threshold_ms=app.config['SLOW_QUERY_MS'],
+                           title="Slow queries")
+
+
+@app.route('/metrics/slow-queries/clear', methods=['POST'])
+def clear_slow_queries():
+    slow_query_log.clear()
+    flash("Slow-query log cleared.", "success")
+    return redirect(url_for('slow_queries'))
+
+
+# <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< JSON API <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
+# Versioned JSON endpoints for scanners and ERP sync:
+#   GET   /api/v1/<resource>            list (cursor pagination, ?fields=, ?ids=)
+#   GET   /api/v1/<resource>/<id>       one object
+#   POST  /api/v1/<resource>            bulk create: JSON array of objects
+#   PATCH /api/v1/<resource>            bulk update: JSON array of objects with "id"
+#   GET   /api/v1/inventory             dashboard stats
+# Bulk writes are all-or-nothing: one transaction, and any bad item
+# rejects the whole request with per-item errors.
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+# Objects per bulk request / ids per bulk GET
+API_MAX_BULK = 10000
+API_MAX_IDS = 1000
+
+# resource -> how to read it (FROM, field -> SQL expression) and write it
+API_RESOURCES = {
+    'stock': {
+        'table': 'stock',
+        'alias': 's',
+        'from': """stock s
+            JOIN fixtures f ON s.fixture_id = f.id
+            LEFT JOIN warehouses w ON s.warehouse_id = w.id
+            LEFT JOIN clients c ON s.client_id = c.id""",
+        'fields': {
+            'id': 's.id', 'serial_number': 's.serial_number', 'status': 's.status',
+            'fixture_id': 's.fixture_id', 'fixture_name': 'f.name',
+            'warehouse_id': 's.warehouse_id', 'warehouse_name': 'w.name',
+            'client_id': 's.client_id', 'client_name': 'c.name',
+            'mfg_date': 's.mfg_date', 'install_date': 's.install_date',
+        },
+        'writable': ('serial_number', 'fixture_id', 'status', 'warehouse_id', 'client_id',
+                     'mfg_date', 'install_date'),
+        'required': ('serial_number', 'fixture_id'),
+        # Scanners know serials, not ids: PATCH may identify units either way
+        'keys': ('id', 'serial_number'),
+    },
+    'fixtures': {
+        'table': 'fixtures',
+        'alias': 'f',
+        'from': """fixtures f
+            LEFT JOIN fixture_types t ON f.type_id = t.id
+            LEFT JOIN suppliers p ON f.supplier_id = p.id""",
+        'fields': {
+            'id': 'f.id', 'name': 'f.name', 'model_name': 'f.model_name',
+            'factory_model_name': 'f.factory_model_name', 'sku': 'f.sku',
+            'type_id': 'f.type_id', 'type_name': 't.name',
+            'supplier_id': 'f.supplier_id', 'supplier_name': 'p.name',
+            'power_watts': 'f.power_watts', 'color': 'f.color', 'beam_angle': 'f.beam_angle',
+            'ip_rating': 'f.ip_rating', 'weight_kg': 'f.weight_kg', 'cost': 'f.cost',
+            'price_sgd': 'f.price_sgd', 'price_usd': 'f.price_usd', 'remarks': 'f.remarks',
+        },
+        'writable': ('name', 'model_name', 'factory_model_name', 'sku', 'type_id', 'supplier_id',
+                     'power_watts', 'color', 'beam_angle', 'ip_rating', 'weight_kg', 'cost',
+                     'price_sgd', 'price_usd', 'remarks'),
+        'required': ('name',),
+        'keys': ('id',),
+    },
+    'warehouses': {
+        'table': 'warehouses',
+        'alias': 'w',
+        'from': "warehouses w",
+        'fields': {'id': 'w.id', 'name': 'w.name', 'location': 'w.location'},
+        'writable': ('name', 'location'),
+        'required': ('name',),
+        'keys': ('id',),
+    },
+    'clients': {
+        'table': 'clients',
+        'alias': 'c',
+        'from': "clients c",
+        'fields': {'id': 'c.id', 'name': 'c.name', 'contact_info': 'c.contact_info'},
+        'writable': ('name', 'contact_info'),
+        'required': ('name',),
+        'keys': ('id',),
+    },
+}
+
+
+class ApiError(Exception):
+    """A request the API rejects; `errors` lists per-item problems for bulk writes."""
+
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+
+@app.errorhandler(ApiError)
+def api_error(e):
+    body = {'error': str(e)}
+    if e.errors:
+        body['errors'] = e.errors
+    return jsonify(body), e.status
+
+
+def api_resource(resource):
+    spec = API_RESOURCES.get(resource)
+    if spec is None:
+        raise ApiError(f"Unknown resource '{resource}'.", 404)
+    return spec
+
+
+def api_fields(spec):
+    """The ?fields= selection (always including id), or every field."""
+    requested = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    if not requested:
+        return list(spec['fields'])
+    unknown = [f for f in requested if f not in spec['fields']]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}.")
+    return ['id'] + [f for f in dict.fromkeys(requested) if f != 'id']
+
+
+def api_select(db, spec, fields, clauses, params, limit=None):
+    columns = ", ".join(f"{spec['fields'][f]} AS {f}" for f in fields)
+    sql = f"SELECT {columns} FROM {spec['from']}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {spec['alias']}.id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = [*params, limit]
+    return [dict(r) for r in db.execute(sql, params)]
+
+
+def api_fetch_ids(db, spec, fields, ids):
+    """Objects for a list of ids (one IN query per API_MAX_IDS)."""
+    rows = []
+    for start in range(0, len(ids), API_MAX_IDS):
+        chunk = ids[start:start + API_MAX_IDS]
+        rows += api_select(db, spec, fields,
+                           [f"{spec['alias']}.id IN ({', '.join('?' * len(chunk))})"], chunk)
+    return rows
+
+
+@app.route('/api/v1/<resource>', methods=['GET'])
+def api_list(resource):
+    """
+    List a resource in id order, `limit` objects per page. Pass the returned
+    next_cursor as ?cursor= for the next page. ?ids=1,2,3 fetches exactly
+    those objects instead. /api/v1/stock also takes the /stock filters.
+    """
+    spec = api_resource(resource)
+    fields = api_fields(spec)
+    db = get_db()
+
+    if request.args.get('ids'):
+        try:
+            ids = [int(i) for i in request.args['ids'].split(',') if i.strip()]
+        except ValueError:
+            raise ApiError("ids must be a comma-separated list of whole numbers.")
+        if len(ids) > API_MAX_IDS:
+            raise ApiError(f"At most {API_MAX_IDS} ids per request.")
+        rows = api_fetch_ids(db, spec, fields, ids)
+        found = {r['id'] for r in rows}
+        return jsonify({'data': rows, 'missing': [i for i in dict.fromkeys(ids) if i not in found]})
+
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    clauses, params = [], []
+    if resource == 'stock':
+        clauses, params = stock_where(stock_filters_from_args(request.args))
+    cursor = decode_cursor(request.args.get('cursor'))
+    if cursor is not None:
+        clauses.append(f"{spec['alias']}.id > ?")
+        params.append(cursor[1])
+    rows = api_select(db, spec, fields, clauses, params, limit + 1)
+    next_cursor = encode_cursor(None, rows[limit - 1]['id']) if len(rows) > limit else None
+    return jsonify({'data': rows[:limit], 'next_cursor': next_cursor})
+
+
+@app.route('/api/v1/<resource>/<int:id>')
+def api_get(resource, id):
+    spec = api_resource(resource)
+    rows = api_fetch_ids(get_db(), spec, api_fields(spec), [id])
+    if not rows:
+        raise ApiError(f"No {resource} object with id {id}.", 404)
+    return jsonify(rows[0])
+
+
+def api_clean_item(spec, item, creating):
+    """
+    Validate one object of a bulk write and return (key, values): the
+    identifying (column, value) for updates (None for creates) and the
+    columns to write. Raises ValueError with a message for the caller.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Each item must be a JSON object.")
+    # Objects and arrays can't be stored in a column
+    nested = [k for k, v in item.items() if not isinstance(v, (str, int, float, bool, type(None)))]
+    if nested:
+        raise ValueError("; ".join(f"{k} must be a string, number, boolean or null" for k in nested) + ".")
+    key = None
+    values = dict(item)
+    if not creating:
+        key_column = next((k for k in spec['keys'] if values.get(k) not in (None, '')), None)
+        if key_column is None:
+            raise ValueError(f"Missing {' or '.join(spec['keys'])}.")
+        key = (key_column, values.pop(key_column))
+    else:
+        values.pop('id', None)
+        missing = [f for f in spec['required'] if values.get(f) in (None, '')]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}.")
+    unknown = [k for k in values if k not in spec['writable']]
+    if unknown:
+        raise ValueError(f"Not writable: {', '.join(unknown)}.")
+    if not creating and not values:
+        raise ValueError("Nothing to update.")
+
+    if spec['table'] == 'stock':
+        if 'status' in values or creating:
+            raw = values.get('status') or statuses.DEFAULT
+            values['status'] = statuses.normalize_status(raw)
+            if values['status'] is None:
+                raise ValueError(f"Unknown status '{raw}'.")
+        for column in ('mfg_date', 'install_date'):
+            if values.get(column):
+                values[column] = dates.parse_date(values[column])
+    return key, values
+
+
+def api_bulk_write(spec, creating):
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        raise ApiError("Send a non-empty JSON array of objects.")
+    if len(items) > API_MAX_BULK:
+        raise ApiError(f"At most {API_MAX_BULK} objects per request.")
+
+    cleaned, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            cleaned.append(api_clean_item(spec, item, creating))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise ApiError("Nothing was written.", 422, errors)
+
+    table = spec['table']
+
+    def write(db):
+        ids, problems = [], []
+        for index, (key, values) in enumerate(cleaned):
+            columns = list(values)
+            try:
+                if creating:
+                    cursor = db.execute(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        [values[c] for c in columns])
+                    ids.append(cursor.lastrowid)
+                    continue
+                row = db.execute(
+                    f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE {key[0]} = ? RETURNING id",
+                    [*(values[c] for c in columns), key[1]]).fetchone()
+            except sqlite3.IntegrityError as e:
+                problems.append({'index': index, 'error': str(e)})
+                continue
+            if row is None:
+                problems.append({'index': index, 'error': f"No {table} object with {key[0]} {key[1]}."})
+            else:
+                ids.append(row[0])
+        if problems:
+            # Rolls back every item of this request (see database.Writer)
+            raise ApiError("Nothing was written.", 422, problems)
+        return ids
+
+    ids = db_writer.run(write)
+    return api_fetch_ids(get_db(), spec, list(spec['fields']), ids)
+
+
+@app.route('/api/v1/<resource>', methods=['POST'])
+def api_create(resource):
+    """Create every object in the JSON array, in one transaction."""
+    spec = api_resource(resource)
+    return jsonify({'data': api_bulk_write(spec, creating=True)}), 201
+
+
+@app.route('/api/v1/<resource>', methods=['PATCH'])
+def api_update(resource):
+    """Apply every partial update in the JSON array, in one transaction."""
+    spec = api_resource(resource)
+    return jsonify({'data': api_bulk_write(spec, creating=False)})
+
+
+@app.route('/api/v1/inventory/at')
+def api_inventory_at():
+    """
+    Unit counts per warehouse (or ?dimension=client), fixture and status as
+    they stood at ?at= (an ISO date, meaning end of day, or datetime),
+    rebuilt from the movement ledger.
+    """
+    dimension = request.args.get('dimension', 'warehouse')
+    if dimension not in ledger.DIMENSIONS:
+        raise ApiError("dimension must be 'warehouse' or 'client'.")
+    try:
+        at = ledger.to_timestamp(request.args.get('at', ''))
+    except ValueError:
+        raise ApiError("at must be an ISO date (YYYY-MM-DD) or datetime.")
+
+    db = get_db()
+    rows, info = ledger.counts_at(db, at, dimension)
+    table = 'warehouses' if dimension == 'warehouse' else 'clients'
+    names = dict(db.execute(f"SELECT id, name FROM {table}").fetchall())
+    fixture_names = dict(db.execute("SELECT id, name FROM fixtures").fetchall())
+    for row in rows:
+        row[f'{dimension}_name'] = names.get(row[f'{dimension}_id'])
+        row['fixture_name'] = fixture_names.get(row['fixture_id'])
+    return jsonify({'at': datetime.fromtimestamp(at).isoformat(), 'dimension': dimension,
+                    'data': rows, **info})
+
+
+@app.route('/api/v1/stock/<int:id>/history')
+def api_stock_history(id):
+    """
+    A unit's movements, oldest first. With ?at= just its fixture, status,
+    warehouse and client at that moment.
+    """
+    db = get_db()
+    if request.args.get('at'):
+        try:
+            at = ledger.to_timestamp(request.args['at'])
+        except ValueError:
+            raise ApiError("at must be an ISO date (YYYY-MM-DD) or datetime.")
+        state = ledger.unit_at(db, id, at)
+        if state is None:
+            raise ApiError(f"No record of unit {id} at {request.args['at']}.", 404)
+        return jsonify(state)
+    movements = ledger.unit_history(db, id)
+    if not movements:
+        raise ApiError(f"No history for unit {id}.", 404)
+    return jsonify({'stock_id': id, 'movements': movements})
+
+
+@app.route('/api/v1/inventory')
+def api_inventory():
+    """The /inventory dashboard's figures."""
+    context = cached_result(load_dashboard)
+    return jsonify({name: dict(value) if isinstance(value, sqlite3.Row) else [dict(r) for r in value]
+                    for name, value in context.items() if name not in DASHBOARD_LOOKUPS})
+
+# -------------------------------- MAINTENANCE COMMANDS --------------------------------
+
+# Tables whose ids sample_get_urls() borrows for /<prefix>/.../<int:id> routes
+EXPLAIN_ID_TABLES = {
+    '/clients': 'clients',
+    '/fixtures': 'fixtures',
+    '/fixture-types': 'fixture_types',
+    '/suppliers': 'suppliers',
+    '/warehouses': 'warehouses',
+    '/stock': 'stock',
+    '/jobs': 'jobs',
+    '/api/v1/stock': 'stock',
+}
+
+
+def sample_get_urls(db):
+    """
+    Yield (endpoint, url) for every GET route, filled in with real ids and
+    representative query strings. Used by `flask explain-routes` and the
+    benchmarks in bench/. Routes that need an id from a table with no rows
+    yet (e.g. /jobs/<id> before any upload) are skipped; they can only 404.
+    """
+    row = db.execute("SELECT serial_number FROM stock ORDER BY id LIMIT 1").fetchone()
+    serial = (row and row[0]) or 'A'
+    queries = {
+        'search_all': {'q': serial[:4]},
+        'serial_lookup': {'prefix': serial[:-2] or serial},
+        'api_inventory_at': {'at': datetime.now().date().isoformat()},
+    }
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if 'GET' not in rule.methods or rule.endpoint == 'static':
+            continue
+        variants = [{'resource': r} for r in API_RESOURCES] if 'resource' in rule.arguments else [{}]
+        for kwargs in variants:
+            if 'id' in rule.arguments:
+                if 'resource' in kwargs:
+                    table = API_RESOURCES[kwargs['resource']]['table']
+                else:
+                    prefixes = sorted(EXPLAIN_ID_TABLES, key=len, reverse=True)
+                    prefix = next((p for p in prefixes if rule.rule.startswith(p + '/')), None)
+                    table = EXPLAIN_ID_TABLES.get(prefix)
+                row = db.execute(f"SELECT MIN(id) FROM {table}").fetchone() if table else None
+                if table and row[0] is None:
+                    continue
+                kwargs['id'] = (row and row[0]) or 1
+            with app.test_request_context():
+                yield rule.endpoint, url_for(rule.endpoint, **kwargs, **queries.get(rule.endpoint, {}))
+
+
+@app.cli.command('summaries')
+@click.option('--rebuild', is_flag=True, help="Recompute the summary tables from stock.")
+def summaries_command(rebuild):
+    """Verify (or rebuild) the dashboard's stock summary tables."""
+    db = connect_db()
+    if rebuild:
+        summaries.rebuild(db)
+        db.commit()
+        bump_generation(db)
+        click.echo("Summary tables rebuilt from stock.")
+
+    problems = summaries.drift(db)
+    for table, key, stored, actual in problems:
+        click.echo(f"{table} {key}: stored {stored}, actual {actual}")
     db.close()
-    return render_template('inventory.html', 
-                           stats=stats, 
-                           warehouses=warehouses, 
-                           inventory_split=inventory_split,
-                           logistics_data=logistics_data,
-                           sales_split=sales_split,
-                           sold_to_clients=sold_to_clients,
-                           now=now,
-                           under_maintenance_clients=under_maintenance_clients,
-                           title="Inventory")
+    if problems:
+        click.echo(f"{len(problems)} group(s) drifted. Run with --rebuild to fix.")
+        raise SystemExit(1)
+    click.echo("Summary tables match stock.")
+
+
+@app.cli.command('explain-routes', with_appcontext=False)
+def explain_routes():
+    """Print EXPLAIN QUERY PLAN for every query each GET route runs.
+
+    Each GET route is requested through the test client with SQL tracing on,
+    with empty caches and in an app context of its own (so it opens its own
+    traced connection); every SELECT it issued is then explained. Plan steps
+    that walk the whole stock table without an index are marked with "!!".
+    """
+    db = connect_db()
+    stock_scans = 0
+
+    for endpoint, url in list(sample_get_urls(db)):
+        statements = []
+        result_cache.clear()
+        fragment_cache.clear()
+        app.config['SQL_TRACE'] = statements
+        try:
+            with app.app_context():
+                app.test_client().get(url, buffered=True)
+        finally:
+            app.config['SQL_TRACE'] = None
+
+        click.echo(click.style(f"== {endpoint}  GET {url}", bold=True))
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            click.echo("   " + " ".join(sql.split()))
+            details = [plan_row[3] for plan_row in db.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+            for detail, scan in zip(details, slowlog.stock_scans(sql, details)):
+                if scan:
+                    stock_scans += 1
+                click.echo(("   !! " if scan else "      ") + detail)
+        click.echo("")
+
+    db.close()
+    click.echo(f"{stock_scans} unindexed scan(s) of the stock table.")
 
 # -------------------------------- RUN THE APP --------------------------------
 
+def warm_up(open_db=True):
+    """
+    Do the one-off work a worker's first request would otherwise pay for:
+    compile every template, build the URL matcher and, with open_db, open
+    this thread's read connection and load the schema. The gunicorn hooks
+    (gunicorn.conf.py) call it once in the master before forking, without
+    the database, and again in each worker.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.test_request_context('/inventory'):
+        pass
+    if open_db:
+        db = database.thread_connection()
+        db.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        database.release(db)
+    startup_timings['warm_up'] = time.perf_counter() - STARTUP_BEGAN
+
+# Bring the schema up to date whenever a worker loads the app. Under gunicorn
+# with preload_app this runs in the master, which must not run imports (its
+# job threads and connections would not survive fork()), so gunicorn.conf.py
+# defers recovery to the workers.
+init_db(recover=not os.environ.get('LUMIPRO_DEFER_JOB_RECOVERY'))
+startup_timings['init_db'] = time.perf_counter() - STARTUP_BEGAN
+
 if __name__ == "__main__":
-    init_db()  # Ensure DB is initialized on startup
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Cold-start benchmark with a budget.
+
+Starts fresh Python processes the way Passenger does (import app, serve one
+request) and measures import time and time to the first response. Exits
+non-zero if the median time to first response exceeds --budget-ms or if
+a module listed in --forbid was imported at startup, so slow startups
+don't creep back in unnoticed.
+
+    python bench/coldstart.py                       # check the default budget
+    python bench/coldstart.py --profile             # plus the slowest imports
+    python bench/coldstart.py --budget-ms 600 --runs 9
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGET_MS = 800
+# Heavy modules that no route needs at startup
+FORBIDDEN = ('pandas', 'pyarrow', 'numpy')
+
+# Runs in the child process: a worker's whole life up to its first response
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get({url!r})
+response.get_data()
+answered = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (answered - started) * 1000,
+    'status': response.status_code,
+    'phases': app.startup_timings,
+    'modules': sorted(name for name in sys.modules if '.' not in name),
+}}))
+"""
+
+
+def run_child(env, url, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+              ['-c', CHILD.format(repo=REPO_DIR, url=url)]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, limit):
+    """
+    app.py and the modules it imports directly, from -X importtime output,
+    slowest cumulative time first.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Each nesting level indents the name by two more spaces
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level <= 1:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help=f"max median time to first response (default {BUDGET_MS})")
+    parser.add_argument('--forbid', default=','.join(FORBIDDEN),
+                        help="comma-separated modules that must not be imported at startup")
+    parser.add_argument('--url', default='/inventory', help="the first request (default /inventory)")
+    parser.add_argument('--units', type=int, default=1000, help="units in the generated database")
+    parser.add_argument('--profile', action='store_true', help="also print the slowest imports")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='lumipro-coldstart-')
+    path = os.path.join(workdir, 'bench.db')
+    env = dict(os.environ, LUMIPRO_DATABASE=path)
+    # Generate (and migrate) in a child too, so this process never imports the app
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, 'bench', 'generate.py'), path,
+                    '--units', str(args.units)], env=env, check=True, stdout=subprocess.DEVNULL)
+    # The first start after generating still has to compile bytecode
+    run_child(env, args.url)
+
+    samples = [run_child(env, args.url)[0] for _ in range(args.runs)]
+    imports = statistics.median(s['import_ms'] for s in samples)
+    first = statistics.median(s['first_response_ms'] for s in samples)
+    print(f"{args.runs} cold starts, median: import {imports:.0f} ms, first response {first:.0f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+    phases = samples[-1]['phases']
+    print("  phases (s since app.py began loading): " +
+          ", ".join(f"{phase} {seconds:.3f}" for phase, seconds in phases.items()))
+
+    if args.profile:
+        _, stderr = run_child(env, args.url, importtime=True)
+        print("  slowest imports (cumulative):")
+        for cumulative_us, name in slowest_imports(stderr, 15):
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if first > args.budget_ms:
+        failures.append(f"median first response {first:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    forbidden = [m for m in args.forbid.split(',') if m and m in samples[-1]['modules']]
+    if forbidden:
+        failures.append(f"imported at startup: {', '.join(forbidden)}")
+    if any(s['status'] >= 500 for s in samples):
+        failures.append(f"{args.url} failed with status {samples[-1]['status']}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
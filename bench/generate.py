@@ -0,0 +1,162 @@
+"""
+Fill a fresh database with synthetic but realistic data.
+
+Rows are bulk-inserted into the bare schema.sql tables first and the
+migrations run afterwards, the same way an existing database is upgraded,
+so the summary tables, search index and movement ledger are built with
+set-based statements instead of one trigger call per unit.
+
+    python bench/generate.py bench.db --units 100000
+    python bench/generate.py bench.db --units 1000000 --clients 5000 --force
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import database  # noqa: E402
+import migrations  # noqa: E402
+import statuses  # noqa: E402
+
+# Share of units per status, roughly what the live database looks like
+STATUS_MIX = [
+    ('FOR SALE', 0.34),
+    ('IN WAREHOUSE', 0.20),
+    ('SOLD', 0.26),
+    ('INSTALLED', 0.08),
+    ('MAINTENANCE', 0.05),
+    ('REPAIR', 0.03),
+    ('IN TRANSIT', 0.04),
+]
+# Where a unit in each status is: at a warehouse, at a client, or neither
+AT_WAREHOUSE = {'FOR SALE', 'IN WAREHOUSE', 'REPAIR'}
+AT_CLIENT = {'SOLD', 'INSTALLED', 'MAINTENANCE'}
+
+FIXTURE_TYPES = ['Moving Head', 'LED Par', 'Wash', 'Beam', 'Spot', 'Profile', 'Strobe', 'LED Bar',
+                 'Fresnel', 'Follow Spot', 'Blinder', 'Pixel Bar', 'Hazer', 'Uplight', 'Cyc Light']
+COLORS = ['RGBW', 'RGBA', 'RGBWA+UV', 'Warm White', 'Cool White', 'CMY + CTO', 'Tunable White']
+IP_RATINGS = ['IP20', 'IP20', 'IP54', 'IP65', 'IP65', 'IP66']
+POWER_WATTS = [60, 90, 120, 150, 200, 250, 300, 350, 440, 600, 800, 1000]
+CITIES = ['Singapore', 'Kuala Lumpur', 'Jakarta', 'Bangkok', 'Manila', 'Ho Chi Minh City', 'Sydney']
+NAME_PARTS = ['Apex', 'Nova', 'Lumen', 'Stellar', 'Prism', 'Vertex', 'Aurora', 'Pulse', 'Zenith', 'Orbit',
+              'Halo', 'Titan', 'Vivid', 'Quantum', 'Spectra', 'Radiant']
+CLIENT_KINDS = ['Events', 'Productions', 'Theatre', 'Hotel', 'Church', 'Studios', 'Arena', 'Club', 'Rentals']
+
+BATCH_SIZE = 50000
+
+
+def _name(rng, suffix):
+    return f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_PARTS)} {suffix}"
+
+
+def generate(path, units=10000, suppliers=20, fixture_types=10, fixtures=200, warehouses=8,
+             clients=500, seed=42, echo=print):
+    """Create `path` from schema.sql, fill it, and bring it to the latest migration."""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    db = database.connect(path)
+    database.enable_wal(db)
+    with open(os.path.join(REPO_DIR, 'schema.sql')) as f:
+        db.executescript(f.read())
+    # stock.status references statuses; migration 3 would seed it too late
+    db.executemany("INSERT OR IGNORE INTO statuses (code, label, category) VALUES (?, ?, ?)",
+                   statuses.STATUSES)
+
+    db.executemany("INSERT INTO suppliers (name, contact_person, email, phone) VALUES (?, ?, ?, ?)", [
+        (f"{_name(rng, 'Lighting')} {i}", f"Contact {i}", f"sales{i}@supplier{i}.example", f"+86 755 {i:07d}")
+        for i in range(1, suppliers + 1)])
+    types = FIXTURE_TYPES[:fixture_types] + [f"Type {i}" for i in range(len(FIXTURE_TYPES), fixture_types)]
+    db.executemany("INSERT INTO fixture_types (name) VALUES (?)", [(t,) for t in types])
+    fixture_rows = []
+    for i in range(1, fixtures + 1):
+        type_id = rng.randint(1, fixture_types)
+        power = rng.choice(POWER_WATTS)
+        cost = round(power * rng.uniform(1.5, 4.0), 2)
+        fixture_rows.append((
+            f"{rng.choice(NAME_PARTS)} {types[type_id - 1]} {power}",
+            f"LP-{types[type_id - 1][:2].upper()}{i:04d}", f"F{rng.randint(1000, 9999)}-{i}", f"SKU-{i:05d}",
+            type_id, rng.randint(1, suppliers), power, rng.choice(COLORS), f"{rng.choice([4, 8, 15, 25, 40])}°",
+            rng.choice(IP_RATINGS), round(power / 40 + rng.uniform(1, 8), 1), cost, round(cost * 1.8, 2),
+            round(cost * 1.35, 2), rng.choice(['', '', 'DMX + RDM', 'Art-Net / sACN', 'Includes flight case'])))
+    db.executemany("""
+        INSERT INTO fixtures (name, model_name, factory_model_name, sku, type_id, supplier_id, power_watts,
+                              color, beam_angle, ip_rating, weight_kg, cost, price_sgd, price_usd, remarks)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, fixture_rows)
+    db.executemany("INSERT INTO warehouses (name, location) VALUES (?, ?)", [
+        (f"{CITIES[i % len(CITIES)]} WH{i + 1}", f"{rng.randint(1, 99)} Industrial Rd, {CITIES[i % len(CITIES)]}")
+        for i in range(warehouses)])
+    db.executemany("INSERT INTO clients (name, contact_info) VALUES (?, ?)", [
+        (f"{_name(rng, rng.choice(CLIENT_KINDS))} {i}", f"ops{i}@client{i}.example")
+        for i in range(1, clients + 1)])
+
+    # Units arrive in production runs: contiguous serials of one model
+    # with the same manufacturing date, e.g. LP-2024-000100 .. 000599.
+    codes = [code for code, _ in STATUS_MIX]
+    weights = [weight for _, weight in STATUS_MIX]
+    today = date.today()
+    batch, made, serial = [], 0, 0
+    while made < units:
+        run = min(rng.randint(20, 500), units - made)
+        fixture_id = rng.randint(1, fixtures)
+        mfg = today - timedelta(days=rng.randint(30, 4 * 365))
+        for status in rng.choices(codes, weights, k=run):
+            serial += 1
+            warehouse_id = rng.randint(1, warehouses) if status in AT_WAREHOUSE else None
+            client_id = rng.randint(1, clients) if status in AT_CLIENT else None
+            install = None
+            if client_id is not None:
+                install = (mfg + timedelta(days=rng.randint(14, max(15, (today - mfg).days)))).isoformat()
+            batch.append((fixture_id, f"LP-{mfg.year}-{serial:07d}", status, client_id, warehouse_id,
+                          install, mfg.isoformat()))
+        made += run
+        if len(batch) >= BATCH_SIZE or made >= units:
+            db.executemany("""
+                INSERT INTO stock (fixture_id, serial_number, status, client_id, warehouse_id, install_date, mfg_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+            batch = []
+            echo(f"  {made:,} / {units:,} units")
+    db.commit()
+    echo(f"Inserted rows in {time.perf_counter() - started:.1f}s; running migrations...")
+
+    for version, description in migrations.migrate(db):
+        echo(f"  migration {version}: {description}")
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+    echo(f"Generated {path} in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('path', help="database file to create")
+    parser.add_argument('--units', type=int, default=10000, help="stock units (default 10000)")
+    parser.add_argument('--suppliers', type=int, default=20)
+    parser.add_argument('--fixture-types', type=int, default=10)
+    parser.add_argument('--fixtures', type=int, default=200)
+    parser.add_argument('--warehouses', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="replace the file if it exists")
+    args = parser.parse_args()
+
+    if args.force:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    generate(args.path, units=args.units, suppliers=args.suppliers, fixture_types=args.fixture_types,
+             fixtures=args.fixtures, warehouses=args.warehouses, clients=args.clients, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Route-level benchmarks.
+
+Generates a database (see generate.py), then drives every GET route
+through Flask's test client and both CSV import paths through their
+upload routes and background jobs. Reports latency percentiles, rows/sec
+and peak memory, and writes everything to a JSON file. Pass an earlier
+file as --baseline to print the change per route. A route answering
+outside 2xx/3xx, or an import job that fails, is reported as FAILED
+without timings, and the run exits non-zero.
+
+    python bench/run.py --units 100000 --out bench-results.json
+    python bench/run.py --units 100000 --out after.json --baseline before.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'n': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'p50_ms': round(pick(50), 3),
+        'p90_ms': round(pick(90), 3),
+        'p95_ms': round(pick(95), 3),
+        'p99_ms': round(pick(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def peak_memory(fn):
+    """Peak Python heap allocated while fn() runs, in MiB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_routes(app_module, repeat, echo):
+    app = app_module.app
+    client = app.test_client()
+    db = app_module.connect_db()
+    urls = list(app_module.sample_get_urls(db))
+    db.close()
+
+    results = {}
+    for endpoint, url in urls:
+        def get():
+            response = client.get(url, buffered=True)
+            response.get_data()
+            return response
+
+        # Cold: empty result caches (the first visitor after a write)
+        app_module.result_cache.clear()
+        app_module.fragment_cache.clear()
+        started = time.perf_counter()
+        status = get().status_code
+        cold = time.perf_counter() - started
+
+        # An error page's latency says nothing about the route: flag it instead
+        if not 200 <= status < 400:
+            results[url] = {'endpoint': endpoint, 'status': status, 'failed': True}
+            echo(f"  {url:<60} FAILED with status {status}")
+            continue
+
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            status = get().status_code
+            samples.append(time.perf_counter() - started)
+            if not 200 <= status < 400:
+                break
+
+        app_module.result_cache.clear()
+        app_module.fragment_cache.clear()
+        if not 200 <= status < 400:
+            results[url] = {'endpoint': endpoint, 'status': status, 'failed': True}
+            echo(f"  {url:<60} FAILED with status {status}")
+            continue
+        results[url] = {'endpoint': endpoint, 'status': status, 'cold_ms': round(cold * 1000, 3),
+                        **percentiles(samples), 'peak_mib': peak_memory(get)}
+        echo(f"  {url:<60} p50 {results[url]['p50_ms']:>9.2f} ms   p95 {results[url]['p95_ms']:>9.2f} ms")
+    return results
+
+
+def wait_for_job(app_module, job_id, timeout=3600):
+    db = app_module.connect_db()
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = app_module.jobs.get(db, job_id)
+            if job['status'] in ('done', 'failed'):
+                return job
+            time.sleep(0.01)
+        raise TimeoutError(f"job {job_id} did not finish")
+    finally:
+        db.close()
+
+
+def bench_imports(app_module, rows, echo):
+    """Time both CSV upload paths end to end: POST, background job, commit."""
+    client = app_module.app.test_client()
+    db = app_module.connect_db()
+    fixture_id = db.execute("SELECT MIN(id) FROM fixtures").fetchone()[0]
+    warehouse_id = db.execute("SELECT MIN(id) FROM warehouses").fetchone()[0]
+    existing = [r[0] for r in db.execute("SELECT serial_number FROM stock ORDER BY id LIMIT ?", (rows,))]
+    warehouse_names = [r[0] for r in db.execute("SELECT name FROM warehouses")]
+    client_names = [r[0] for r in db.execute("SELECT name FROM clients")]
+    db.close()
+
+    new_units = "serial_number,mfg_date\n" + "".join(
+        f"BENCH-{i:08d},{1 + i % 28:02d}/0{1 + i % 9}/2023\n" for i in range(rows))
+    # Mostly existing names, plus a few new ones for the update to create
+    def update_row(i, sn):
+        if i % 3:
+            warehouse = f"Bench Warehouse {i % 5}" if i % 50 == 1 else warehouse_names[i % len(warehouse_names)]
+            return f"{sn},IN WAREHOUSE,{warehouse},,\n"
+        client = f"Bench Client {i % 7}" if i % 50 == 0 else client_names[i % len(client_names)]
+        return f"{sn},SOLD,,{client},2024-0{1 + i % 9}-15\n"
+    updates = "serial_number,status,warehouse_name,client_name,install_date\n" + "".join(
+        update_row(i, sn) for i, sn in enumerate(existing))
+
+    cases = [
+        ('bulk_upload_stock', '/stock/bulk-upload', new_units,
+         {'fixture_id': fixture_id, 'warehouse_id': warehouse_id}),
+        ('bulk_update_stock_csv', '/stock/bulk-update-csv', updates, {}),
+    ]
+    results = {}
+    for name, url, body, form in cases:
+        data_rows = body.count('\n') - 1
+        outcome = {}
+
+        def run():
+            started = time.perf_counter()
+            response = client.post(url, data={**form, 'file': (io.BytesIO(body.encode()), 'bench.csv')},
+                                   headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+            job = wait_for_job(app_module, response.get_json()['id'])
+            outcome['seconds'] = time.perf_counter() - started
+            outcome['job'] = job
+
+        peak = peak_memory(run)
+        job = outcome['job']
+        results[name] = {
+            'rows': data_rows,
+            'status': job['status'],
+            'summary': job['result'],
+            'seconds': round(outcome['seconds'], 3),
+            'rows_per_sec': round(data_rows / outcome['seconds'], 1),
+            'peak_mib': peak,
+        }
+        echo(f"  {name:<25} {data_rows:,} rows in {outcome['seconds']:.2f}s "
+             f"({results[name]['rows_per_sec']:,.0f} rows/s, {job['status']})")
+    return results
+
+
+def compare(current, baseline, echo):
+    """Print p50 changes per route and import throughput changes against a baseline run."""
+    echo(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} "
+         f"({baseline['meta']['units']:,} units):")
+    for url, now in current['routes'].items():
+        before = baseline['routes'].get(url)
+        if now.get('failed'):
+            echo(f"  {url:<60} FAILED with status {now['status']}")
+        elif before and not before.get('failed'):
+            change = (now['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            echo(f"  {url:<60} p50 {before['p50_ms']:>9.2f} -> {now['p50_ms']:>9.2f} ms ({change:+.0f}%)")
+    for name, now in current['imports'].items():
+        before = baseline['imports'].get(name)
+        if before:
+            echo(f"  {name:<60} {before['rows_per_sec']:>9,.0f} -> {now['rows_per_sec']:>9,.0f} rows/s")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--units', type=int, default=10000, help="stock units to generate (default 10000)")
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--fixtures', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20, help="timed requests per route (default 20)")
+    parser.add_argument('--import-rows', type=int, default=None,
+                        help="rows per CSV import (default: a tenth of --units)")
+    parser.add_argument('--db', help="reuse this generated database instead of making a new one (it is modified)")
+    parser.add_argument('--out', default='bench-results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='lumipro-bench-')
+    path = os.path.abspath(args.db or os.path.join(workdir, 'bench.db'))
+    # database.py reads its path at import time, so set it before
+    # importing anything from the repo (generate imports database)
+    os.environ['LUMIPRO_DATABASE'] = path
+    import generate
+    if not args.db:
+        generate.generate(path, units=args.units, clients=args.clients, fixtures=args.fixtures)
+
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    app_module.UPLOAD_DIR = os.path.join(workdir, 'uploads')
+
+    print("\nRoutes:")
+    routes = bench_routes(app_module, args.repeat, print)
+    print("\nCSV imports:")
+    imports = bench_imports(app_module, args.import_rows or max(1, args.units // 10), print)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'units': args.units,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'routes': routes,
+        'imports': imports,
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        'max_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1),
+    }
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.out} (peak RSS {results['max_rss_mib']} MiB)")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f), print)
+
+    failures = [url for url, r in routes.items() if r.get('failed')] + \
+               [name for name, r in imports.items() if r['status'] != 'done']
+    if failures:
+        print(f"\nFAILED: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+In-process result cache for read-heavy pages.
+
+Cached values are tagged with the database's data generation: a counter in
+the `meta` table that every write bumps (the request writer does it in
+each of its transactions, import jobs when they commit). A lookup whose
+stored generation differs from the current one is a miss, so a cached
+result is never served after the data it came from has changed, even if
+another worker made the change.
+
+The same counter drives conditional GETs: it goes into each ETag, and the
+`modified_at` row next to it (Unix time of the last bump) is the
+Last-Modified date. Template fragments wrapped in {% cache %} (see
+FragmentCacheExtension) are stored in a ResultCache by generation too, one
+bounded by the total size of the HTML it holds.
+"""
+
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+def current_generation(db):
+    row = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    return row[0] if row else 0
+
+
+def generation_state(db):
+    """(generation, modified_at) in one read; modified_at is Unix time, 0 if unknown."""
+    values = dict(db.execute("SELECT key, value FROM meta WHERE key IN ('generation', 'modified_at')").fetchall())
+    return values.get('generation', 0), values.get('modified_at', 0)
+
+
+def bump_generation(db, commit=True):
+    """Mark all cached results stale. Commits unless commit=False."""
+    db.execute("""
+        UPDATE meta
+        SET value = CASE key WHEN 'generation' THEN value + 1 ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+        WHERE key IN ('generation', 'modified_at')
+    """)
+    if commit:
+        db.commit()
+
+
+class ResultCache:
+    """
+    A thread-safe LRU map of key -> (generation, value) with hit/miss counters.
+
+    With maxbytes, the summed sizeof(value) of the entries is kept under it
+    as well, and a value bigger than maxbytes on its own is not stored.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, generation, compute):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == generation:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Compute outside the lock so a slow query doesn't block other keys
+        value = compute()
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return value
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (generation, value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Jinja tag that renders its body once and reuses the output:
+
+        {% cache 'inventory_warehouses' %} ... {% endcache %}
+
+    The key is the tag's arguments. The app provides the storage by setting
+    `environment.fragment_cache = fn(key, render)`, which returns either a
+    cached rendering or render().
+
+    The body is rendered to one string before anything is output, so a
+    block around a large, streamed table would hold it back until the
+    whole table is done.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=lambda key, render: render())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        return self.environment.fragment_cache(tuple(key), caller)
@@ -0,0 +1,220 @@
+"""
+SQLite connection layer.
+
+All connections go through `connect()`, which opens the database by
+absolute path and applies the per-connection pragmas below. The database
+itself runs in WAL mode (set once by `enable_wal()` at startup), so readers
+never wait for a writer and a writer waits at most BUSY_TIMEOUT_MS for
+another writer instead of failing with "database is locked".
+
+Request handlers read through `thread_connection()`, a read-only
+connection kept per worker thread and reused across requests (and its
+prepared-statement cache with it). Read-only connections never take the
+write lock, so under WAL any number of them run in parallel, in every
+worker, while an import is writing.
+
+Request-time writes go through a `Writer` instead: one connection and
+thread per process that runs queued writes back to back, committing
+everything that queued up meanwhile in a single short transaction.
+"""
+
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE = os.environ.get('LUMIPRO_DATABASE') or os.path.join(BASE_DIR, 'database.db')
+
+BUSY_TIMEOUT_MS = 10000
+# Prepared statements kept per connection (Python's default is 128)
+STATEMENT_CACHE_SIZE = 512
+# How long Writer.run waits for its write: a few lock timeouts' worth
+WRITE_TIMEOUT = 6 * BUSY_TIMEOUT_MS / 1000
+
+PRAGMAS = [
+    # Safe with WAL: a power loss can only drop the last commits, not corrupt
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    # Read through a 256 MiB memory map instead of read() syscalls
+    "PRAGMA mmap_size = 268435456",
+    # 32 MiB page cache per connection (negative = KiB)
+    "PRAGMA cache_size = -32768",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+]
+
+_local = threading.local()
+
+
+def connect(path=None, readonly=False):
+    """
+    Open a new, fully configured connection. The caller owns (and closes) it.
+
+    With readonly=True the file is opened through a `mode=ro` URI, so any
+    attempt to write raises sqlite3.OperationalError.
+    """
+    path = path or DATABASE
+    if readonly:
+        path = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+    db = sqlite3.connect(path,
+                         timeout=BUSY_TIMEOUT_MS / 1000,
+                         cached_statements=STATEMENT_CACHE_SIZE,
+                         uri=readonly)
+    db.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def enable_wal(db):
+    """Switch the database file to WAL journaling (persistent; idempotent)."""
+    return db.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+
+
+def thread_connection():
+    """
+    The calling thread's long-lived read-only connection, opened on first use.
+
+    The process id is checked too: a connection inherited across fork()
+    (gunicorn --preload) must never be used by the child.
+    """
+    db = getattr(_local, 'db', None)
+    if db is None or _local.pid != os.getpid():
+        db = _local.db = connect(readonly=True)
+        _local.pid = os.getpid()
+    return db
+
+
+def release(db):
+    """End-of-request cleanup: never leave a transaction open on a reused connection."""
+    if db.in_transaction:
+        db.rollback()
+
+
+class Writer:
+    """
+    Serializes this process's writes onto one connection and thread.
+
+    `run(fn)` queues `fn(db)` and blocks until it has been committed,
+    returning its result or re-raising its exception. The writer thread
+    takes everything queued so far (up to max_batch) and runs it in one
+    BEGIN IMMEDIATE transaction, each write inside its own savepoint so a
+    failing one is rolled back alone. Concurrent small writes therefore
+    share one lock acquisition and one commit, and the lock is held only
+    for as long as the SQL itself takes.
+
+    `fn` must not commit or roll back. `before_commit(db)`, if given, runs
+    once per transaction in which at least one write succeeded, and
+    `after_batch(db)` once each batch has been answered, committed or not.
+    `connect()`, if given, opens the writer's connection instead of
+    connect(path).
+
+    If the writer thread can't open its connection, everything queued so
+    far fails with that error and the next `run` starts a fresh thread
+    (and tries again). A caller never waits more than WRITE_TIMEOUT: past
+    that it gets sqlite3.OperationalError, though its write may still be
+    committed later.
+    """
+
+    def __init__(self, path=None, max_batch=64, before_commit=None, after_batch=None, connect=None):
+        self.path = path
+        self.max_batch = max_batch
+        self.before_commit = before_commit
+        self.after_batch = after_batch
+        self.connect = connect
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run(self, fn):
+        future = Future()
+        self._submit((fn, future))
+        try:
+            return future.result(timeout=WRITE_TIMEOUT)
+        except FutureTimeout:
+            raise sqlite3.OperationalError(
+                f"The database writer did not answer within {WRITE_TIMEOUT:.0f} seconds.") from None
+
+    def execute(self, sql, params=()):
+        """Run one statement; returns the (lastrowid, rowcount) of its cursor."""
+        def statement(db):
+            cursor = db.execute(sql, params)
+            return cursor.lastrowid, cursor.rowcount
+        return self.run(statement)
+
+    def _submit(self, item):
+        # Like the jobs pool, the thread is started lazily and per process.
+        # Queuing under the lock means no write lands on a queue after
+        # _loop has given up on it.
+        with self._lock:
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, args=(self._queue,),
+                                 name='db-writer', daemon=True).start()
+            self._queue.put(item)
+
+    def _loop(self, pending):
+        try:
+            db = self.connect() if self.connect else connect(self.path)
+        except Exception as e:
+            with self._lock:
+                if self._queue is pending:
+                    self._queue = None
+            while True:
+                try:
+                    _, future = pending.get_nowait()
+                except queue.Empty:
+                    return
+                future.set_exception(e)
+        while True:
+            batch = [pending.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(db, batch)
+            if self.after_batch:
+                try:
+                    self.after_batch(db)
+                except Exception:
+                    # Housekeeping must never take the writer thread down
+                    pass
+
+    def _commit(self, db, batch):
+        outcomes = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                db.execute("SAVEPOINT write")
+                try:
+                    value = fn(db)
+                except Exception as e:
+                    db.execute("ROLLBACK TO write")
+                    db.execute("RELEASE write")
+                    outcomes.append((future, None, e))
+                else:
+                    db.execute("RELEASE write")
+                    outcomes.append((future, value, None))
+            if self.before_commit and any(error is None for _, _, error in outcomes):
+                self.before_commit(db)
+            db.commit()
+        except Exception as e:
+            # The transaction itself failed (lock timeout, disk full...):
+            # nothing in the batch was committed.
+            if db.in_transaction:
+                db.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # Only answer callers once their writes are durable and visible
+        for future, value, error in outcomes:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,116 @@
+"""
+Date normalization for imports and the API.
+
+Dates are stored as YYYY-MM-DD. `parse_date` converts one value and is what
+single-record paths (the API, bulk edits) use. CSV imports use a DateColumn
+per date column instead: it picks the column's format once, from a sample
+of its first values, and then converts each batch with one vectorized
+pandas pass. Only the values that pass misses go through the formats one
+by one, so the per-value strptime loop no longer runs once per row.
+
+A sample whose values all read the same way as DD/MM/YYYY and MM/DD/YYYY
+(no part over 12) is flagged as ambiguous. It is read day first, as
+parse_date has always done. Values no format accepts are returned as
+failures for the caller to report; they are never stored as typed.
+
+pandas is imported on first use, so loading the app doesn't pay for it.
+"""
+
+from datetime import datetime
+
+# (strptime format, how it's shown to users), in the order parse_date tries them
+FORMATS = [
+    ('%Y-%m-%d', 'YYYY-MM-DD'),   # 2023-12-31
+    ('%d/%m/%Y', 'DD/MM/YYYY'),   # 31/12/2023
+    ('%m/%d/%Y', 'MM/DD/YYYY'),   # 12/31/2023
+    ('%d-%m-%Y', 'DD-MM-YYYY'),   # 31-12-2023
+    ('%Y/%m/%d', 'YYYY/MM/DD'),   # 2023/12/31
+    ('%d %b %Y', 'DD Mon YYYY'),  # 31 Dec 2023
+    ('%b %d, %Y', 'Mon DD, YYYY'),  # Dec 31, 2023
+]
+# Formats that read the same digits with day and month swapped
+SWAPPED = {'%d/%m/%Y': '%m/%d/%Y', '%m/%d/%Y': '%d/%m/%Y'}
+# Non-blank values a DateColumn looks at to choose its format
+SAMPLE_SIZE = 500
+
+
+def parse_date(value):
+    """
+    `value` as YYYY-MM-DD, trying each of FORMATS in order. None for a
+    blank value; ValueError if no format matches.
+    """
+    if value is None or not str(value).strip():
+        return None
+    value = str(value).strip()
+    for fmt, _ in FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date '{value}'.")
+
+
+class DateColumn:
+    """One date column of an import, converted a batch at a time."""
+
+    def __init__(self, name):
+        self.name = name
+        # Formats seen in the sample, best first; None until the first values arrive
+        self.formats = None
+        self.ambiguous = False
+
+    def infer(self, sample):
+        """Rank FORMATS by how many `sample` values each one reads."""
+        import pandas as pd
+        sample = pd.Series(sample, dtype=object)
+        hits = {fmt: int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+                for fmt, _ in FORMATS}
+        self.formats = sorted((fmt for fmt, _ in FORMATS if hits[fmt]), key=lambda fmt: -hits[fmt])
+        best = self.formats[0] if self.formats else None
+        if best in SWAPPED and hits[SWAPPED[best]] == hits[best]:
+            # Nothing in the sample tells day from month: keep day first
+            self.ambiguous = True
+            self.formats.remove('%d/%m/%Y')
+            self.formats.insert(0, '%d/%m/%Y')
+
+    def convert(self, values):
+        """
+        Normalize a batch of raw strings. Returns (dates, failed): `dates`
+        has YYYY-MM-DD or None (blank or unparseable) for each value and
+        `failed` the positions of values that no format could read.
+        """
+        import numpy as np
+        import pandas as pd
+        raw = pd.Series(values, dtype=object).str.strip()
+        present = raw.notna() & (raw != '')
+        if self.formats is None:
+            if not present.any():
+                return [None] * len(values), []
+            self.infer(raw[present].head(SAMPLE_SIZE))
+
+        parsed = pd.Series(pd.NaT, index=raw.index, dtype='datetime64[ns]')
+        for fmt in self.formats:
+            missing = present & parsed.isna()
+            if not missing.any():
+                break
+            parsed[missing] = pd.to_datetime(raw[missing], format=fmt, errors='coerce')
+
+        dates = np.full(len(raw), None, dtype=object)
+        done = parsed.notna()
+        dates[done.to_numpy()] = parsed[done].to_numpy().astype('datetime64[D]').astype(str)
+        failed = []
+        # Whatever the ranked formats missed: other formats, or dates outside
+        # the range pandas can hold (before 1677 or after 2262)
+        for pos in (present & ~done).to_numpy().nonzero()[0]:
+            try:
+                dates[pos] = parse_date(raw.iat[pos])
+            except ValueError:
+                failed.append(int(pos))
+        return dates.tolist(), failed
+
+    def describe(self):
+        """How the column was read, for the import summary; None if it was empty."""
+        if not self.formats:
+            return None
+        label = dict(FORMATS)[self.formats[0]]
+        return f"{label} (ambiguous day/month order)" if self.ambiguous else label
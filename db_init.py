@@ -1,24 +1,19 @@
-import sqlite3
-from flask import Flask, render_template, g
+import os
+import database
+import migrations
 
-app = Flask(__name__)
-DATABASE = 'database.db'
-
-def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row # Allows accessing columns by name
-    return db
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def init_db():
-    with app.app_context():
-        db = get_db()
-        with open('schema.sql', mode='r') as f:
-            db.cursor().executescript(f.read())
-        db.commit()
-        print("Database Initialized!")
+    db = database.connect()
+    database.enable_wal(db)
+    with open(os.path.join(BASE_DIR, 'schema.sql'), mode='r') as f:
+        db.cursor().executescript(f.read())
+    db.commit()
+    migrations.migrate(db)
+    db.close()
+    print("Database Initialized!")
 
 if __name__ == '__main__':
     # Run init_db() once manually or uncomment the line below on first run:
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,37 @@
+"""
+gunicorn settings (read automatically from the working directory, or via
+`gunicorn -c gunicorn.conf.py app:app`).
+
+The app is imported once in the master (preload_app): imports, migrations
+and template compilation happen there a single time and every worker is
+forked with them already done, instead of each worker paying for them
+before its first request.
+
+Imports left behind by a stopped worker are re-queued from post_fork, in a
+worker, rather than while the master loads the app.
+"""
+
+import os
+
+# bind and workers keep gunicorn's defaults, which follow $PORT and
+# $WEB_CONCURRENCY
+preload_app = True
+
+# Read by app.py while the master loads it: run jobs.recover() in the workers
+os.environ['LUMIPRO_DEFER_JOB_RECOVERY'] = '1'
+
+
+def when_ready(server):
+    # Master, after the app is loaded. No database connection here: SQLite
+    # connections must not be carried across fork().
+    from app import warm_up
+    warm_up(open_db=False)
+
+
+def post_fork(server, worker):
+    # Each worker opens its own read connection before taking requests, and
+    # re-queues orphaned imports; jobs.recover() claims each job atomically,
+    # so only one of the workers starting together runs it
+    from app import recover_jobs, warm_up
+    warm_up()
+    recover_jobs()
@@ -0,0 +1,179 @@
+"""
+Background jobs for long-running imports.
+
+Uploads are saved to disk and recorded in the `jobs` table, then run on a
+small thread pool inside the worker process so the HTTP request can return
+immediately. Progress, errors and the final result are written back to the
+jobs row, so any worker can answer GET /jobs/<id>.
+
+Each import commits in a single transaction at the end, so a job that dies
+with its worker has changed nothing and can simply be run again.
+`recover()` (called at startup) re-queues jobs whose worker process is gone
+and marks them failed after MAX_ATTEMPTS.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MAX_ATTEMPTS = 3
+
+# kind -> fn(db, job, progress) returning (summary dict, problems list).
+# Registered by app.py through @jobs.runner(kind).
+RUNNERS = {}
+
+_connect = None
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def configure(connect):
+    """Set the factory used to open a database connection for job threads."""
+    global _connect
+    _connect = connect
+
+
+def runner(kind):
+    """Register `fn(db, job, progress)` as the handler for jobs of `kind`."""
+    def register(fn):
+        RUNNERS[kind] = fn
+        return fn
+    return register
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _pool():
+    # Created lazily and per process: threads don't survive a fork, so a
+    # pool made before gunicorn forks its workers would be dead in them.
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # One thread: imports in the same worker run one after another
+            # rather than competing for the write lock.
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import-job')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _update(job_id, **fields):
+    db = _connect()
+    try:
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        db.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def submit(kind, file_path, filename, params=None):
+    """Record a new job and queue it. Returns the job id."""
+    db = _connect()
+    try:
+        job_id = db.execute("""
+            INSERT INTO jobs (kind, filename, file_path, params, status, pid, created_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?)
+        """, (kind, filename, file_path, json.dumps(params or {}), os.getpid(), _now())).lastrowid
+        db.commit()
+    finally:
+        db.close()
+    _pool().submit(_run, job_id)
+    return job_id
+
+
+def get(db, job_id):
+    """Return the job as a dict (params/result/problems decoded), or None."""
+    row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ('params', 'result', 'problems'):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+def _run(job_id):
+    db = _connect()
+    try:
+        job = get(db, job_id)
+        if job is None or job['status'] not in ('queued', 'running'):
+            return
+        _update(job_id, status='running', pid=os.getpid(), attempts=job['attempts'] + 1,
+                started_at=_now(), rows_processed=0, error_count=0)
+
+        def progress(rows, errors):
+            _update(job_id, rows_processed=rows, error_count=errors)
+
+        try:
+            summary, problems = RUNNERS[job['kind']](db, job, progress)
+        except Exception as e:
+            db.rollback()
+            _update(job_id, status='failed', message=str(e), finished_at=_now())
+            _discard_file(job)
+            return
+
+        _update(job_id, status='done', result=json.dumps(summary), problems=json.dumps(problems),
+                error_count=len(problems), finished_at=_now())
+        _discard_file(job)
+    finally:
+        db.close()
+
+
+def _discard_file(job):
+    try:
+        os.remove(job['file_path'])
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover(db):
+    """
+    Re-queue jobs orphaned by a dead worker.
+
+    A queued or running job whose worker pid no longer exists is run again
+    in this process, since its transaction never committed. After
+    MAX_ATTEMPTS, or if the uploaded file is gone, it is marked failed
+    instead of being silently lost.
+    Returns the number of jobs re-queued.
+    """
+    requeued = 0
+    rows = db.execute("""
+        SELECT id, pid, attempts, file_path FROM jobs
+        WHERE status IN ('queued', 'running')
+    """).fetchall()
+    for job_id, pid, attempts, file_path in rows:
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        if attempts >= MAX_ATTEMPTS or not os.path.exists(file_path):
+            db.execute("""
+                UPDATE jobs SET status = 'failed', finished_at = ?,
+                    message = 'Worker stopped before the import finished; nothing was changed. Please upload again.'
+                WHERE id = ? AND pid IS ?
+            """, (_now(), job_id, pid))
+            db.commit()
+            continue
+        # Claim it; if another starting worker got there first, leave it
+        claimed = db.execute("UPDATE jobs SET status = 'queued', pid = ? WHERE id = ? AND pid IS ?",
+                             (os.getpid(), job_id, pid)).rowcount
+        db.commit()
+        if claimed:
+            _pool().submit(_run, job_id)
+            requeued += 1
+    return requeued
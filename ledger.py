@@ -0,0 +1,242 @@
+"""
+Append-only stock movement ledger with checkpoint snapshots.
+
+Triggers on stock (created by migration 8) append one row to
+`stock_movements` whenever a unit is created, deleted, or changes fixture,
+status, warehouse or client. The row holds the unit's old and new values
+of those four columns and a Unix timestamp, so it answers "where was unit
+X at time T" directly (its last movement before T).
+
+Point-in-time inventory counts start from the nearest known state and
+replay only the movements in between:
+
+  * a snapshot: a copy of both stock summary tables (summaries.py) taken
+    at a known movement id, stored in `stock_snapshot_counts`;
+  * or the live summary tables, which are the state as of the latest
+    movement.
+
+Movements after the starting point are added; when starting from a later
+state, the movements in between are subtracted instead. `maybe_snapshot()`
+takes a new snapshot every SNAPSHOT_INTERVAL movements, so no query ever
+replays more than about half that many.
+"""
+
+from datetime import datetime
+
+SNAPSHOT_INTERVAL = 10000
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY,
+        stock_id INTEGER NOT NULL,          -- no FK: history outlives deleted units
+        at INTEGER NOT NULL,                -- Unix time
+        old_fixture_id INTEGER,             -- old_* are NULL for a new unit
+        old_status TEXT,
+        old_warehouse_id INTEGER,
+        old_client_id INTEGER,
+        new_fixture_id INTEGER,             -- new_* are NULL for a deleted unit
+        new_status TEXT,
+        new_warehouse_id INTEGER,
+        new_client_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_movements_stock ON stock_movements (stock_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_movements_at ON stock_movements (at)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        id INTEGER PRIMARY KEY,
+        taken_at INTEGER NOT NULL,
+        last_movement_id INTEGER NOT NULL   -- state includes movements up to this id
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_snapshots_movement ON stock_snapshots (last_movement_id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshot_counts (
+        snapshot_id INTEGER NOT NULL,
+        dimension TEXT NOT NULL,            -- warehouse, client
+        ref_id INTEGER NOT NULL,            -- warehouse_id (0 = none) or client_id
+        fixture_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_id, dimension, ref_id, fixture_id, status)
+    ) WITHOUT ROWID
+    """,
+]
+
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+_COLUMNS = ('fixture_id', 'status', 'warehouse_id', 'client_id')
+
+CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_insert AFTER INSERT ON stock
+    BEGIN
+        INSERT INTO stock_movements (stock_id, at, {', '.join('new_' + c for c in _COLUMNS)})
+        VALUES (NEW.id, {_NOW}, {', '.join('NEW.' + c for c in _COLUMNS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_delete AFTER DELETE ON stock
+    BEGIN
+        INSERT INTO stock_movements (stock_id, at, {', '.join('old_' + c for c in _COLUMNS)})
+        VALUES (OLD.id, {_NOW}, {', '.join('OLD.' + c for c in _COLUMNS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_update
+    AFTER UPDATE OF {', '.join(_COLUMNS)} ON stock
+    WHEN {' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in _COLUMNS)}
+    BEGIN
+        INSERT INTO stock_movements (stock_id, at, {', '.join('old_' + c for c in _COLUMNS)},
+                                     {', '.join('new_' + c for c in _COLUMNS)})
+        VALUES (OLD.id, {_NOW}, {', '.join('OLD.' + c for c in _COLUMNS)},
+                {', '.join('NEW.' + c for c in _COLUMNS)});
+    END
+    """,
+]
+
+# dimension -> (live summary table, its key column, movement key with {side} = old/new,
+#               condition for a movement side to count in this dimension)
+DIMENSIONS = {
+    'warehouse': ('stock_summary_warehouse', 'warehouse_id',
+                  "COALESCE({side}_warehouse_id, 0)", "{side}_status IS NOT NULL"),
+    'client': ('stock_summary_client', 'client_id',
+               "{side}_client_id", "{side}_client_id IS NOT NULL"),
+}
+
+
+def install(db):
+    """Create the ledger tables and the stock triggers that append to it."""
+    for sql in CREATE_TABLES + CREATE_TRIGGERS:
+        db.execute(sql)
+
+
+def record_baseline(db):
+    """Log every existing unit as created now, so each one has a history. Caller commits."""
+    db.execute(f"""
+        INSERT INTO stock_movements (stock_id, at, {', '.join('new_' + c for c in _COLUMNS)})
+        SELECT id, {_NOW}, {', '.join(_COLUMNS)} FROM stock ORDER BY id
+    """)
+
+
+def _last_movement_id(db):
+    return db.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0]
+
+
+def snapshot(db):
+    """Checkpoint the current counts (from the summary tables). Caller commits."""
+    snapshot_id = db.execute(f"""
+        INSERT INTO stock_snapshots (taken_at, last_movement_id) VALUES ({_NOW}, ?)
+    """, (_last_movement_id(db),)).lastrowid
+    for dimension, (table, key, _, _) in DIMENSIONS.items():
+        db.execute(f"""
+            INSERT INTO stock_snapshot_counts (snapshot_id, dimension, ref_id, fixture_id, status, qty)
+            SELECT ?, ?, {key}, fixture_id, status, qty FROM {table} WHERE qty <> 0
+        """, (snapshot_id, dimension))
+    return snapshot_id
+
+
+def maybe_snapshot(db):
+    """Take a snapshot if SNAPSHOT_INTERVAL movements have accrued since the last one."""
+    last_snapshot = db.execute("SELECT COALESCE(MAX(last_movement_id), 0) FROM stock_snapshots").fetchone()[0]
+    if _last_movement_id(db) - last_snapshot >= SNAPSHOT_INTERVAL:
+        return snapshot(db)
+    return None
+
+
+def to_timestamp(value):
+    """
+    Unix time for an ISO date or datetime (server local time). A bare
+    date means the end of that day. Raises ValueError.
+    """
+    value = value.strip()
+    if len(value) == 10:
+        value += 'T23:59:59'
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def _boundary(db, at):
+    """Id of the last movement at or before Unix time `at` (0 if none)."""
+    return db.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements WHERE at <= ?",
+                      (at,)).fetchone()[0]
+
+
+def counts_at(db, at, dimension='warehouse'):
+    """
+    Unit counts per (warehouse or client, fixture, status) as of Unix time
+    `at`, reconstructed from the nearest snapshot (or the live summaries).
+
+    Returns (rows, info): rows are {'<dimension>_id', 'fixture_id',
+    'status', 'qty'} dicts and info says where replay started and how many
+    movements it covered.
+    """
+    table, key, side_key, side_counts = DIMENSIONS[dimension]
+    # One read transaction, so the summaries and movements agree
+    db.execute("BEGIN")
+    try:
+        boundary = _boundary(db, at)
+        starts = [(_last_movement_id(db), None)]
+        for op, order in (('<=', 'DESC'), ('>=', 'ASC')):
+            row = db.execute(f"""
+                SELECT last_movement_id, id FROM stock_snapshots
+                WHERE last_movement_id {op} ? ORDER BY last_movement_id {order} LIMIT 1
+            """, (boundary,)).fetchone()
+            if row:
+                starts.append((row[0], row[1]))
+        start, snapshot_id = min(starts, key=lambda s: abs(s[0] - boundary))
+
+        counts = {}
+        if snapshot_id is None:
+            base = db.execute(f"SELECT {key}, fixture_id, status, qty FROM {table}")
+        else:
+            base = db.execute("""
+                SELECT ref_id, fixture_id, status, qty FROM stock_snapshot_counts
+                WHERE snapshot_id = ? AND dimension = ?
+            """, (snapshot_id, dimension))
+        for ref_id, fixture_id, status, qty in base:
+            counts[(ref_id, fixture_id, status)] = qty
+
+        # Replay forward (add) up to the boundary, or backward (subtract) down to it
+        sign = 1 if start <= boundary else -1
+        low, high = sorted((start, boundary))
+        sides = []
+        for side, weight in (('new', sign), ('old', -sign)):
+            sides.append(f"""
+                SELECT {side_key.format(side=side)} AS ref_id, {side}_fixture_id AS fixture_id,
+                       {side}_status AS status, {weight} AS delta
+                FROM stock_movements
+                WHERE id > ? AND id <= ? AND {side_counts.format(side=side)}
+            """)
+        for ref_id, fixture_id, status, delta in db.execute(f"""
+            SELECT ref_id, fixture_id, status, SUM(delta) FROM (
+                {sides[0]} UNION ALL {sides[1]}
+            )
+            GROUP BY 1, 2, 3
+        """, (low, high, low, high)):
+            counts[(ref_id, fixture_id, status)] = counts.get((ref_id, fixture_id, status), 0) + delta
+    finally:
+        db.rollback()
+
+    rows = [{f'{dimension}_id': ref_id, 'fixture_id': fixture_id, 'status': status, 'qty': qty}
+            for (ref_id, fixture_id, status), qty in sorted(counts.items()) if qty]
+    info = {'snapshot_id': snapshot_id, 'replayed_movements': high - low, 'last_movement_id': boundary}
+    return rows, info
+
+
+def unit_history(db, stock_id):
+    """Every movement of one unit, oldest first."""
+    return [dict(r) for r in db.execute("""
+        SELECT * FROM stock_movements WHERE stock_id = ? ORDER BY id
+    """, (stock_id,))]
+
+
+def unit_at(db, stock_id, at):
+    """The unit's fixture/status/warehouse/client as of Unix time `at`, or None if unknown then."""
+    row = db.execute(f"""
+        SELECT at, {', '.join('new_' + c for c in _COLUMNS)} FROM stock_movements
+        WHERE stock_id = ? AND id <= ?
+        ORDER BY id DESC LIMIT 1
+    """, (stock_id, _boundary(db, at))).fetchone()
+    if row is None or row['new_status'] is None:
+        return None
+    return {'since': row['at'], **{c: row['new_' + c] for c in _COLUMNS}}
@@ -0,0 +1,281 @@
+"""
+Per-request performance metrics in Prometheus text format.
+
+app.py times every request and wraps the request's read connection
+(get_db()) in an InstrumentedConnection, which counts the statements run,
+the rows fetched and the time spent inside SQLite. SQLite does most of a
+query's work while rows are being stepped through, not in execute(), so
+fetching and iterating are timed too. Template render time comes from
+Flask's template signals. With keep_queries, each statement's own time
+and row count are kept too, for the slow-query log (slowlog.py), which
+also instruments the connections that live outside a request this way.
+
+When a request finishes, its figures are added to per-endpoint histograms
+in REGISTRY, which GET /metrics renders. Like the result cache, the
+figures are kept per worker process.
+"""
+
+import threading
+import time
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# name -> (help, buckets, RequestStats attribute or None for wall time)
+HISTOGRAMS = {
+    'lumipro_request_duration_seconds': ("Wall time to build the response", DURATION_BUCKETS, None),
+    'lumipro_request_sql_seconds': ("Time spent in SQLite on the request's read connection",
+                                    DURATION_BUCKETS, 'sql_time'),
+    'lumipro_request_sql_statements': ("SQL statements run per request", STATEMENT_BUCKETS, 'statements'),
+    'lumipro_request_sql_rows': ("Rows fetched per request", ROW_BUCKETS, 'rows'),
+    'lumipro_request_template_seconds': ("Template render time per request", DURATION_BUCKETS, 'template_time'),
+}
+
+
+class RequestStats:
+    """Counters for the request in progress (kept on flask.g)."""
+
+    __slots__ = ('started', 'statements', 'sql_time', 'rows', 'template_time', 'queries')
+
+    def __init__(self, keep_queries=False):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.template_time = 0.0
+        # [sql, params, seconds, rows] per statement, when kept
+        self.queries = [] if keep_queries else None
+
+    def server_timing(self, wall):
+        """Server-Timing header value: total, SQL, template and everything else, in ms."""
+        other = max(0.0, wall - self.sql_time - self.template_time)
+        return (f'total;dur={wall * 1000:.1f}, '
+                f'db;dur={self.sql_time * 1000:.1f};desc="{self.statements} queries, {self.rows} rows", '
+                f'tpl;dur={self.template_time * 1000:.1f}, '
+                f'app;dur={other * 1000:.1f}')
+
+
+class InstrumentedCursor:
+    """Cursor proxy that charges fetch time and row counts to a RequestStats."""
+
+    def __init__(self, cursor, stats, on_finish=None):
+        self._cursor = cursor
+        self._stats = stats
+        self._on_finish = on_finish
+        self._query = None
+
+    def execute(self, sql, params=()):
+        self._start(sql, params)
+        self._timed(self._cursor.execute, sql, params)
+        self._finish_if_done()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._start(sql, ())
+        self._timed(self._cursor.executemany, sql, seq_of_params)
+        self._finish_if_done()
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self._cursor.arraysize
+        rows = self._timed(self._cursor.fetchmany, size)
+        self._count(len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._count(len(rows))
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            row = self._timed(next, self._cursor)
+        except StopIteration:
+            self._finish()
+            raise
+        self._count(1)
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _start(self, sql, params):
+        # Re-executing a cursor abandons whatever it was still reading
+        self._finish()
+        self._stats.statements += 1
+        if self._stats.queries is not None:
+            self._query = [sql, params, 0.0, 0]
+            self._stats.queries.append(self._query)
+
+    def _count(self, rows):
+        self._stats.rows += rows
+        if self._query is not None:
+            self._query[3] += rows
+
+    def _finish_if_done(self):
+        # No result rows (DDL, a plain INSERT/UPDATE): done once executed
+        if self._cursor.description is None:
+            self._finish()
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if query is not None and self._on_finish:
+            self._on_finish(query)
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats.sql_time += elapsed
+            if self._query is not None:
+                self._query[2] += elapsed
+
+
+class InstrumentedConnection:
+    """
+    Connection proxy whose statements and results are charged to a RequestStats.
+    `on_close(conn)`, if given, runs just before the connection is closed.
+
+    With keep_queries and `on_finish(conn, query)`, each kept statement is
+    handed over as soon as it is finished (executed with no result rows,
+    read to the end, or abandoned by re-executing its cursor) and dropped
+    from stats.queries, which then only holds statements still running.
+    """
+
+    def __init__(self, db, stats, on_close=None, on_finish=None):
+        self._db = db
+        self.stats = stats
+        self.on_close = on_close
+        self.on_finish = on_finish
+
+    def cursor(self):
+        return InstrumentedCursor(self._db.cursor(), self.stats,
+                                  self._finished if self.on_finish else None)
+
+    def _finished(self, query):
+        # Gone from the list if the owner already flushed it
+        queries = self.stats.queries
+        for i in range(len(queries) - 1, -1, -1):
+            if queries[i] is query:
+                del queries[i]
+                self.on_finish(self, query)
+                return
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return self._db.executescript(script)
+        finally:
+            self.stats.sql_time += time.perf_counter() - started
+            self.stats.statements += 1
+
+    def close(self):
+        try:
+            if self.on_close:
+                self.on_close(self)
+        finally:
+            self._db.close()
+
+    @property
+    def connection(self):
+        return self._db
+
+    def __enter__(self):
+        self._db.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._db.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class Registry:
+    """Thread-safe per-endpoint histograms and request counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> {endpoint: [bucket counts..., +Inf count, sum]}
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        # (endpoint, method, status) -> count
+        self._requests = {}
+
+    def observe(self, endpoint, method, status, stats, wall):
+        with self._lock:
+            key = (endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, (_, buckets, attribute) in HISTOGRAMS.items():
+                value = wall if attribute is None else getattr(stats, attribute)
+                series = self._histograms[name].get(endpoint)
+                if series is None:
+                    series = self._histograms[name][endpoint] = [0] * (len(buckets) + 2)
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        series[i] += 1
+                series[-2] += 1
+                series[-1] += value
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {name: {} for name in HISTOGRAMS}
+            self._requests = {}
+
+    def render(self, extra=()):
+        """
+        Everything in Prometheus text exposition format. `extra` is an
+        iterable of (name, type, help, value) samples to append, e.g. gauges
+        read at scrape time.
+        """
+        lines = []
+        with self._lock:
+            lines.append("# HELP lumipro_requests_total Requests handled, by endpoint, method and status")
+            lines.append("# TYPE lumipro_requests_total counter")
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'lumipro_requests_total{{endpoint="{_label(endpoint)}",method="{method}",'
+                             f'status="{status}"}} {count}')
+            for name, (help_text, buckets, _) in HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for endpoint, series in sorted(self._histograms[name].items()):
+                    label = f'endpoint="{_label(endpoint)}"'
+                    for bound, count in zip(buckets, series):
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {series[-2]}')
+                    lines.append(f'{name}_sum{{{label}}} {round(series[-1], 6)}')
+                    lines.append(f'{name}_count{{{label}}} {series[-2]}')
+        for name, kind, help_text, value in extra:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
@@ -0,0 +1,237 @@
+"""
+Versioned schema migrations for database.db.
+
+schema.sql only ever creates missing tables, so an existing database can
+never pick up new indexes or columns from it. Each migration below is a
+numbered step; the number of the last applied step is stored in the
+database header (PRAGMA user_version) and `migrate()` applies anything newer
+when the app starts.
+
+To change the schema, append a new step with the next version number.
+Never edit or renumber a step that has already shipped.
+"""
+
+import ledger
+import search
+import statuses
+import summaries
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register `fn(db)` as schema step `version`."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def current_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db):
+    """
+    Apply every pending migration, one transaction per step.
+
+    Several workers may start at once, so each step takes the write lock
+    (BEGIN IMMEDIATE) and re-reads user_version before running; whoever gets
+    there second sees the step as already applied and skips it.
+
+    Returns a list of (version, description) for the steps applied here.
+    """
+    # Table rebuilds copy rows that may predate a foreign key; enforcement
+    # can only be toggled outside a transaction, so do it around the loop.
+    foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
+    db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        applied = _apply_pending(db)
+    finally:
+        db.execute(f"PRAGMA foreign_keys = {int(foreign_keys)}")
+
+    if applied:
+        # Refresh planner statistics for the new indexes
+        db.execute("PRAGMA optimize")
+    return applied
+
+
+def _apply_pending(db):
+    applied = []
+    for version, description, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current_version(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(db):
+                db.rollback()
+                continue
+            step(db)
+            db.execute(f"PRAGMA user_version = {int(version)}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append((version, description))
+    return applied
+
+
+# -------------------------------- STEPS --------------------------------
+
+@migration(1, "Index stock by the columns routes filter, group and join on")
+def _stock_indexes(db):
+    # Warehouse views, the dashboard's per-warehouse split and the
+    # delete_warehouse check all start from warehouse_id, then status.
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_warehouse_status_fixture
+        ON stock (warehouse_id, status, fixture_id)
+    """)
+    # Client views, the sales breakdown and the delete_client check
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_client_status
+        ON stock (client_id, status)
+    """)
+    # Per-fixture inventory counts on /fixtures and delete_fixture
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_fixture
+        ON stock (fixture_id)
+    """)
+    # Dashboard stats and the /stock status filter
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_status
+        ON stock (status, fixture_id)
+    """)
+
+
+@migration(2, "Index fixtures by category/supplier and master data by name")
+def _lookup_indexes(db):
+    # Model counts on /fixture-types and /suppliers, plus their delete checks
+    db.execute("CREATE INDEX IF NOT EXISTS idx_fixtures_type ON fixtures (type_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_fixtures_supplier ON fixtures (supplier_id)")
+    # Name lookups done by the CSV importers
+    db.execute("CREATE INDEX IF NOT EXISTS idx_fixtures_name ON fixtures (name)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_warehouses_name ON warehouses (name)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_clients_name ON clients (name)")
+
+
+@migration(3, "Canonical status codes: statuses table, normalized rows, stock.status foreign key")
+def _canonical_statuses(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS statuses (
+            code TEXT PRIMARY KEY,
+            label TEXT NOT NULL,
+            category TEXT NOT NULL
+        )
+    """)
+    db.executemany("INSERT OR IGNORE INTO statuses (code, label, category) VALUES (?, ?, ?)",
+                   statuses.STATUSES)
+
+    # Rewrite existing free-text values. Anything unrecognised is kept (as
+    # its upper-cased form) and registered as an extra code rather than lost.
+    for (raw,) in db.execute("SELECT DISTINCT status FROM stock").fetchall():
+        code = statuses.normalize_status(raw)
+        if code is None:
+            code = ' '.join(str(raw or statuses.DEFAULT).split()).upper()
+            db.execute("INSERT OR IGNORE INTO statuses (code, label, category) VALUES (?, ?, 'other')",
+                       (code, code.title()))
+        if code != raw:
+            db.execute("UPDATE stock SET status = ? WHERE status IS ?", (code, raw))
+
+    # SQLite can't add a foreign key to an existing column, so rebuild the
+    # table (unless schema.sql already created it in the new form).
+    has_fk = any(row[2] == 'statuses' for row in db.execute("PRAGMA foreign_key_list(stock)"))
+    if has_fk:
+        return
+    index_sql = [row[0] for row in db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stock' AND sql IS NOT NULL")]
+    seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'stock'").fetchone()
+    db.execute("""
+        CREATE TABLE stock_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fixture_id INTEGER NOT NULL,
+            serial_number TEXT UNIQUE, 
+            status TEXT NOT NULL DEFAULT 'FOR SALE',
+            client_id INTEGER,
+            warehouse_id INTEGER,
+            install_date DATE,
+            mfg_date DATE,
+            FOREIGN KEY (fixture_id) REFERENCES fixtures (id),
+            FOREIGN KEY (client_id) REFERENCES clients (id),
+            FOREIGN KEY (warehouse_id) REFERENCES warehouses (id),
+            FOREIGN KEY (status) REFERENCES statuses (code)
+        )
+    """)
+    columns = "id, fixture_id, serial_number, status, client_id, warehouse_id, install_date, mfg_date"
+    db.execute(f"INSERT INTO stock_new ({columns}) SELECT {columns} FROM stock")
+    db.execute("DROP TABLE stock")
+    db.execute("ALTER TABLE stock_new RENAME TO stock")
+    for sql in index_sql:
+        db.execute(sql)
+    if seq:
+        db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'stock'", (seq[0],))
+
+
+@migration(4, "Trigger-maintained stock summary tables for the dashboard")
+def _stock_summaries(db):
+    # Note: any later step that rebuilds the stock table must call
+    # summaries.install() again, since DROP TABLE also drops its triggers.
+    summaries.install(db)
+    summaries.rebuild(db)
+
+
+@migration(5, "meta table holding the data generation used for cache invalidation")
+def _meta(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+
+
+@migration(6, "jobs table for background CSV imports")
+def _jobs(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,               -- stock_import, stock_update
+            filename TEXT,
+            file_path TEXT NOT NULL,          -- saved upload, removed when finished
+            params TEXT,                      -- JSON
+            status TEXT NOT NULL,             -- queued, running, done, failed
+            rows_processed INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            result TEXT,                      -- JSON summary counts
+            problems TEXT,                    -- JSON list of rejected rows
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            pid INTEGER,                      -- worker process that owns it
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+
+@migration(7, "FTS5 search index over stock, fixtures, clients and suppliers")
+def _search_index(db):
+    # Like the summaries, its triggers must be reinstalled by any later
+    # step that rebuilds one of the indexed tables.
+    search.install(db)
+    search.rebuild(db)
+
+
+@migration(8, "Append-only stock movement ledger with checkpoint snapshots")
+def _ledger(db):
+    ledger.install(db)
+    # Existing units start their history here, and the first snapshot
+    # covers that baseline so replays never have to go through it.
+    ledger.record_baseline(db)
+    ledger.snapshot(db)
+
+
+@migration(9, "Last-modified time next to the data generation, for conditional GETs")
+def _modified_at(db):
+    db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('modified_at', CAST(strftime('%s', 'now') AS INTEGER))")
@@ -0,0 +1,205 @@
+"""
+Dry-run validation of CSV imports.
+
+`check_new_units` and `check_updates` report what import_new_units and
+update_units_from_csv would do with a file, without writing anything. The
+whole file is loaded into a DataFrame and each check runs as one
+vectorized pass, in the same order as in the importer and with the same
+messages, so the report matches the rows the real import would reject. The
+database is only read: existing serials are looked up with one query over
+the serials in the file, and names come from one query per table.
+
+pandas is imported on first use, so loading the app doesn't pay for it.
+"""
+
+import json
+
+import dates
+import statuses
+
+
+class Problems:
+    """Rejected rows, collected a check at a time."""
+
+    def __init__(self):
+        self.frames = []
+
+    def add(self, rows, serials, error):
+        """Report each row number in `rows` with its serial and `error` (a str or Series)."""
+        import pandas as pd
+        if len(rows):
+            self.frames.append(pd.DataFrame({'row': rows, 'serial_number': serials, 'error': error}))
+
+    def records(self):
+        """[{'row', 'serial_number', 'error'}, ...] in row order, checks in the order they ran."""
+        import pandas as pd
+        if not self.frames:
+            return []
+        frame = pd.concat(self.frames, ignore_index=True).sort_values('row', kind='stable')
+        return [{'row': int(row), 'serial_number': serial, 'error': error}
+                for row, serial, error in frame.itertuples(index=False)]
+
+
+def read_csv(stream, required, message):
+    """
+    The CSV as a DataFrame of strings ('' for missing values) with a `row`
+    column holding each record's row number as the importers count it (the
+    header is row 1). Raises ValueError(message) if a required column is absent.
+    """
+    import pandas as pd
+    try:
+        frame = pd.read_csv(stream, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    except pd.errors.EmptyDataError:
+        raise ValueError(message)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Could not read the CSV: {e}")
+    if not required.issubset(frame.columns):
+        raise ValueError(message)
+    frame = frame.fillna('')
+    frame.insert(0, 'row', range(2, len(frame) + 2))
+    return frame
+
+
+def existing_serials(db, serials):
+    """The subset of `serials` already registered, in one indexed query."""
+    # One JSON array back instead of a row object per serial
+    found = db.execute("""
+        SELECT json_group_array(serial_number) FROM stock
+        WHERE serial_number IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(serials)),)).fetchone()[0]
+    return set(json.loads(found))
+
+
+def names(db, table):
+    return {r[0] for r in db.execute(f"SELECT name FROM {table}")}
+
+
+def stripped(frame, column):
+    """
+    frame[column] stripped of surrounding whitespace, or all '' if the file
+    lacks it. Names repeat, so each distinct value is stripped once.
+    """
+    import pandas as pd
+    if column not in frame:
+        return pd.Series('', index=frame.index, dtype=object)
+    values = frame[column]
+    return values.map({value: value.strip() for value in values.unique()})
+
+
+def check_dates(frame, serials, staged, columns, problems):
+    """
+    Convert each date column over the staged rows (see dates.DateColumn)
+    and report rows with a date no format can read, all of a row's bad
+    dates in one message. Returns (mask of those rows, DateColumns).
+    """
+    import pandas as pd
+    bad = pd.Series('', index=frame.index, dtype=object)
+    date_columns = []
+    for name in columns:
+        column = dates.DateColumn(name)
+        date_columns.append(column)
+        if name not in frame:
+            continue
+        raw = frame.loc[staged, name]
+        _, failed = column.convert(raw.tolist())
+        failed = raw.iloc[failed]
+        described = name + " '" + failed.str.strip() + "'"
+        earlier = bad[failed.index]
+        bad[failed.index] = earlier.where(earlier == '', earlier + ', ') + described
+    unreadable = bad != ''
+    problems.add(frame.loc[unreadable, 'row'], serials[unreadable],
+                 "Unrecognized date: " + bad[unreadable] + ".")
+    return unreadable, date_columns
+
+
+def date_format_summary(date_columns):
+    return {f"{c.name} format": c.describe() for c in date_columns if c.describe()}
+
+
+def check_new_units(db, stream, fixture_id, warehouse_id):
+    """
+    Validate a new-units CSV (header: serial_number[, mfg_date]) for
+    import_new_units. Returns {'summary', 'problems'} shaped like the
+    import job's result. Raises ValueError for a file it can't check.
+    """
+    if db.execute("SELECT 1 FROM fixtures WHERE id = ?", (fixture_id,)).fetchone() is None:
+        raise ValueError("The selected fixture model doesn't exist.")
+    if db.execute("SELECT 1 FROM warehouses WHERE id = ?", (warehouse_id,)).fetchone() is None:
+        raise ValueError("The selected warehouse doesn't exist.")
+    frame = read_csv(stream, {'serial_number'}, "Invalid CSV format. Required headers: serial_number")
+    problems = Problems()
+    serials = frame['serial_number'].str.strip()
+
+    empty = serials == ''
+    problems.add(frame.loc[empty, 'row'], serials[empty], "Serial number is empty.")
+    staged = ~empty
+    unreadable, date_columns = check_dates(frame, serials, staged, ['mfg_date'], problems)
+    staged &= ~unreadable
+
+    # Both checks see every staged row, as the importer's two queries do
+    candidates = serials[staged]
+    repeated = candidates.duplicated(keep='first')
+    problems.add(frame.loc[repeated[repeated].index, 'row'], candidates[repeated],
+                 "Serial Number repeated earlier in this file.")
+    taken = candidates.isin(existing_serials(db, candidates.unique()))
+    problems.add(frame.loc[taken[taken].index, 'row'], candidates[taken],
+                 "Serial Number '" + candidates[taken] + "' already exists.")
+
+    problems = problems.records()
+    summary = {'Would import': int((~repeated & ~taken).sum()), 'Rejected rows': len(problems)}
+    summary.update(date_format_summary(date_columns))
+    return {'summary': summary, 'problems': problems}
+
+
+def check_updates(db, stream):
+    """
+    Validate an edited stock export for update_units_from_csv. Returns
+    {'summary', 'problems'} shaped like the update job's result, with the
+    warehouses and clients the update would create. Raises ValueError for a
+    file it can't check.
+    """
+    required = {'serial_number', 'status'}
+    frame = read_csv(stream, required, f"CSV missing required columns: {required}")
+    problems = Problems()
+    serials = frame['serial_number'].str.strip()
+    # Rows without a serial are skipped silently, as the importer does
+    staged = serials != ''
+
+    normalized = {value: statuses.normalize_status(value) for value in frame.loc[staged, 'status'].unique()}
+    unknown = staged & frame['status'].map(normalized).isna()
+    problems.add(frame.loc[unknown, 'row'], serials[unknown],
+                 "Unknown status '" + frame.loc[unknown, 'status'] + "'.")
+    staged &= ~unknown
+    unreadable, date_columns = check_dates(frame, serials, staged, ['mfg_date', 'install_date'], problems)
+    staged &= ~unreadable
+
+    # Each check drops its rows before the next, like the importer's anti-joins
+    missing = staged & ~serials.isin(existing_serials(db, serials[staged].unique()))
+    problems.add(frame.loc[missing, 'row'], serials[missing],
+                 "Serial '" + serials[missing] + "' not found.")
+    staged &= ~missing
+
+    fixtures = stripped(frame, 'fixture_name')
+    no_fixture = staged & (fixtures != '') & ~fixtures.isin(names(db, 'fixtures'))
+    problems.add(frame.loc[no_fixture, 'row'], serials[no_fixture],
+                 "Fixture '" + fixtures[no_fixture] + "' not found.")
+    staged &= ~no_fixture
+
+    later = frame.loc[staged, 'row'].groupby(serials[staged]).shift(-1).dropna().astype(int)
+    problems.add(frame.loc[later.index, 'row'], serials[later.index],
+                 "Serial '" + serials[later.index] + "' appears again on row " + later.astype(str)
+                 + ", which takes precedence.")
+    staged[later.index] = False
+
+    new = {}
+    for column, table in (('warehouse_name', 'warehouses'), ('client_name', 'clients')):
+        wanted = set(stripped(frame, column)[staged].unique()) - {''}
+        new[table] = len(wanted - names(db, table))
+
+    problems = problems.records()
+    summary = {'Would update': int(staged.sum()),
+               'New warehouses': new['warehouses'],
+               'New clients': new['clients'],
+               'Rows not applied': len(problems)}
+    summary.update(date_format_summary(date_columns))
+    return {'summary': summary, 'problems': problems}
@@ -43,19 +43,27 @@ CREATE TABLE IF NOT EXISTS warehouses (
     location TEXT
 );
 
+-- Table: Statuses (canonical stock status codes, seeded by migrations.py)
+CREATE TABLE IF NOT EXISTS statuses (
+    code TEXT PRIMARY KEY,        -- e.g., FOR SALE, SOLD, MAINTENANCE
+    label TEXT NOT NULL,
+    category TEXT NOT NULL        -- in_stock, sold, deployed, repair, transit
+);
+
 -- Updated Stock Table for Individual Unit Tracking
 CREATE TABLE IF NOT EXISTS stock (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     fixture_id INTEGER NOT NULL,
     serial_number TEXT UNIQUE, 
-    status TEXT NOT NULL DEFAULT 'FOR SALE', -- e.g., Available, Installed, Maintenance
+    status TEXT NOT NULL DEFAULT 'FOR SALE', -- canonical code, see statuses table
     client_id INTEGER,                           -- Links to Clients table
     warehouse_id INTEGER,                        -- Current or Home warehouse
     install_date DATE,
     mfg_date DATE,                               -- Manufacturing Date
     FOREIGN KEY (fixture_id) REFERENCES fixtures (id),
     FOREIGN KEY (client_id) REFERENCES clients (id),
-    FOREIGN KEY (warehouse_id) REFERENCES warehouses (id)
+    FOREIGN KEY (warehouse_id) REFERENCES warehouses (id),
+    FOREIGN KEY (status) REFERENCES statuses (code)
 );
 
 -- Ensure you have a Clients table
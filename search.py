@@ -0,0 +1,168 @@
+"""
+Full-text search over stock serials, fixture datasheets, clients and suppliers.
+
+Everything searchable lives in one FTS5 table, `search_index`, with a title
+and a body column. Each document's rowid encodes where it came from:
+rowid = source id * 4 + kind code (see KINDS), so a row can be replaced or
+removed by rowid without scanning the index. Triggers (created by
+migration 7) keep the index in step with every INSERT, UPDATE and DELETE on
+the source tables, including renames that change other rows' documents (a
+fixture's name appears in each of its units' documents, a category's or
+supplier's name in each of its fixtures').
+
+`rebuild()` re-indexes everything; `search()` runs a ranked prefix query.
+"""
+
+import re
+
+KINDS = ('stock', 'fixture', 'client', 'supplier')
+
+
+def _text(*columns):
+    # concat_ws() needs SQLite 3.44; NULL columns must not blank the body
+    return " || ' ' || ".join(f"COALESCE({c}, '')" for c in columns)
+
+
+# kind -> (source table, alias used in the SELECT, SELECT producing rowid, title, body)
+DOCUMENTS = {
+    'stock': ('stock', 's', f"""
+        SELECT s.id * 4 + 0, s.serial_number, {_text('f.name', 'f.model_name')}
+        FROM stock s
+        JOIN fixtures f ON f.id = s.fixture_id
+    """),
+    'fixture': ('fixtures', 'f', f"""
+        SELECT f.id * 4 + 1, f.name,
+               {_text('f.model_name', 'f.factory_model_name', 'f.sku', 'f.color', 'f.beam_angle',
+                      'f.ip_rating', "f.power_watts || 'W'", 't.name', 'p.name', 'f.remarks')}
+        FROM fixtures f
+        LEFT JOIN fixture_types t ON t.id = f.type_id
+        LEFT JOIN suppliers p ON p.id = f.supplier_id
+    """),
+    'client': ('clients', 'c', f"""
+        SELECT c.id * 4 + 2, c.name, {_text('c.contact_info')}
+        FROM clients c
+    """),
+    'supplier': ('suppliers', 'p', f"""
+        SELECT p.id * 4 + 3, p.name, {_text('p.contact_person', 'p.email')}
+        FROM suppliers p
+    """),
+}
+
+# Columns whose change requires re-indexing the source row itself.
+# Kinds not listed re-index on any update.
+UPDATE_COLUMNS = {
+    'stock': ('serial_number', 'fixture_id'),
+}
+
+# (table, columns, dependent kind, WHERE selecting the dependents of NEW)
+DEPENDENTS = [
+    ('fixtures', ('name', 'model_name'), 'stock', 's.fixture_id = NEW.id'),
+    ('fixture_types', ('name',), 'fixture', 'f.type_id = NEW.id'),
+    ('suppliers', ('name',), 'fixture', 'f.supplier_id = NEW.id'),
+]
+
+CREATE_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4'
+    )
+"""
+
+
+def _index(kind, where):
+    table, alias, select = DOCUMENTS[kind]
+    return f"INSERT INTO search_index (rowid, title, body) {select} WHERE {where};"
+
+
+def _unindex(kind, where):
+    table, alias, select = DOCUMENTS[kind]
+    code = KINDS.index(kind)
+    return (f"DELETE FROM search_index WHERE rowid IN "
+            f"(SELECT {alias}.id * 4 + {code} FROM {table} {alias} WHERE {where});")
+
+
+def _triggers():
+    triggers = []
+    for kind, (table, alias, select) in DOCUMENTS.items():
+        code = KINDS.index(kind)
+        delete_old = f"DELETE FROM search_index WHERE rowid = OLD.id * 4 + {code};"
+        triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_insert AFTER INSERT ON {table}
+            BEGIN {_index(kind, f'{alias}.id = NEW.id')} END
+        """)
+        triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_delete AFTER DELETE ON {table}
+            BEGIN {delete_old} END
+        """)
+        columns = UPDATE_COLUMNS.get(kind)
+        when = ""
+        if columns:
+            when = "WHEN " + " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in columns)
+        triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_update
+            AFTER UPDATE {'OF ' + ', '.join(columns) if columns else ''} ON {table} {when}
+            BEGIN {delete_old} {_index(kind, f'{alias}.id = NEW.id')} END
+        """)
+    for table, columns, kind, where in DEPENDENTS:
+        triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_{DOCUMENTS[kind][0]}
+            AFTER UPDATE OF {', '.join(columns)} ON {table}
+            WHEN {' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in columns)}
+            BEGIN {_unindex(kind, where)} {_index(kind, where)} END
+        """)
+    return triggers
+
+
+CREATE_TRIGGERS = _triggers()
+
+
+def install(db):
+    """Create the search index and the triggers that maintain it."""
+    for sql in [CREATE_TABLE] + CREATE_TRIGGERS:
+        db.execute(sql)
+
+
+def rebuild(db):
+    """Re-index every document from scratch. Caller commits."""
+    db.execute("DELETE FROM search_index")
+    for kind in DOCUMENTS:
+        db.execute(_index(kind, "1"))
+    db.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    A word containing punctuation (a serial such as LP-2024-0001) becomes a
+    phrase of its parts, so the parts have to appear in that order.
+    Returns '' when the text has nothing searchable.
+    """
+    terms = []
+    for word in text.split():
+        tokens = re.findall(r'\w+', word.lower())
+        if tokens:
+            terms.append('"' + ' '.join(tokens) + '"*')
+    return ' AND '.join(terms)
+
+
+def search(db, text, limit=20):
+    """
+    Ranked hits for `text` across all kinds, best first.
+
+    Titles weigh ten times as much as bodies. Returns a list of
+    {'kind', 'id', 'title', 'snippet'} dicts.
+    """
+    expression = match_expression(text)
+    if not expression:
+        return []
+    rows = db.execute("""
+        SELECT rowid, title, snippet(search_index, 1, '', '', '…', 12) AS snippet
+        FROM search_index
+        WHERE search_index MATCH ?
+        ORDER BY bm25(search_index, 10.0, 1.0)
+        LIMIT ?
+    """, (expression, limit)).fetchall()
+    return [{'kind': KINDS[row['rowid'] % 4], 'id': row['rowid'] // 4,
+             'title': row['title'], 'snippet': row['snippet']} for row in rows]
@@ -0,0 +1,207 @@
+"""
+Opt-in slow-query log.
+
+When app.config['SLOW_QUERY_MS'] is set, every statement a request runs
+on its read connection is timed separately (see metrics.RequestStats).
+At the end of the request, each one at or over the threshold is explained
+on the same connection, with the same parameters, so the plan is the one
+SQLite chose at that moment. It is then appended to a JSON-lines file
+along with its normalized SQL, parameter shape, duration, rows and route.
+A streamed page keeps reading rows after its first byte, so its
+statements are logged once the whole body has been sent instead.
+
+Connections outside a request are instrumented the same way (app.watched)
+and logged under a name of their own: 'db_writer', 'import_job' or
+'export_stock_csv', with a null method. Their statements are explained as
+soon as each one finishes, while the temp tables an import stages into
+still exist; one still unfinished is logged after the writer's batch or
+when the connection is closed.
+
+The file is shared by all worker processes, and `report()` aggregates it
+by normalized SQL for the /metrics/slow-queries page.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+# Rotate to <path>.1 beyond this size, so the log holds at most twice this
+MAX_BYTES = 5 * 2 ** 20
+MAX_SQL_LENGTH = 4000
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+# Statements with a query plan
+_PLANNED = re.compile(r'\s*(?:SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+# A keyset page: rows in stock id order, cut off by a LIMIT
+_ID_PAGE = re.compile(r'\bORDER\s+BY\s+(\w+)\.id(?:\s+(?:ASC|DESC))?\s+LIMIT\b', re.IGNORECASE)
+_NOT_ALIASES = {'WHERE', 'JOIN', 'LEFT', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'SET', 'WHEN', 'AND'}
+
+
+def normalize(sql):
+    """One-line SQL with literals replaced by ? and placeholder lists collapsed to '?, ...'."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('?, ...', sql)
+    return ' '.join(sql.split())
+
+
+def param_shape(params):
+    """
+    Types of the bound parameters, with runs collapsed: "(int, str x3)"
+    for a sequence, "{name: str}" for named parameters.
+    """
+    if isinstance(params, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}" for key, value in params.items()) + '}'
+    runs = []
+    for value in params or ():
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return '(' + ', '.join(name if count == 1 else f"{name} x{count}" for name, count in runs) + ')'
+
+
+def stock_aliases(sql):
+    """Names a statement uses for the stock table (the table itself plus aliases)."""
+    return {'stock'} | set(re.findall(r'\bstock\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE)) - _NOT_ALIASES
+
+
+def is_stock_scan(detail, names):
+    """True if an EXPLAIN QUERY PLAN step walks the whole stock table (known by `names`)."""
+    words = detail.split()
+    return (len(words) > 1 and words[0] == 'SCAN' and words[1].lower() in {n.lower() for n in names}
+            and 'INDEX' not in detail)
+
+
+def stock_scans(sql, details):
+    """
+    Which of a statement's plan steps (EXPLAIN QUERY PLAN details, in order)
+    walk the whole stock table, as a list of booleans. A scan that an
+    `ORDER BY <stock>.id LIMIT` reads in rowid order, with no temp B-tree
+    for the ORDER BY, stops after one page and isn't counted.
+    """
+    names = stock_aliases(sql)
+    page = _ID_PAGE.search(sql)
+    stops_early = (page is not None and page.group(1).lower() in {n.lower() for n in names}
+                   and not any('TEMP B-TREE FOR ORDER BY' in d for d in details))
+    return [is_stock_scan(d, names) and not stops_early for d in details]
+
+
+def explain(db, sql, params=()):
+    """
+    The plan steps of `sql` as indented strings, or [] if it can't be
+    explained. DDL and transaction control have no plan and aren't tried.
+    """
+    if not _PLANNED.match(sql):
+        return []
+    try:
+        rows = db.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+    depth = {0: -1}
+    steps = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        steps.append('  ' * depth[node_id] + detail)
+    return steps
+
+
+class SlowQueryLog:
+    """Append-only JSON-lines log of slow statements, shared by all workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def capture(self, db, queries, threshold_ms, endpoint, method):
+        """Log every (sql, params, seconds, rows) in `queries` at or over threshold_ms."""
+        entries = []
+        for sql, params, seconds, rows in queries:
+            ms = seconds * 1000
+            if ms < threshold_ms:
+                continue
+            plan = explain(db, sql, params)
+            entries.append({
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'endpoint': endpoint,
+                'method': method,
+                'ms': round(ms, 3),
+                'rows': rows,
+                'sql': normalize(sql)[:MAX_SQL_LENGTH],
+                'params': param_shape(params),
+                'plan': plan,
+                'stock_scan': any(stock_scans(sql, [step.strip() for step in plan])),
+            })
+        if entries:
+            self._append(entries)
+        return entries
+
+    def _append(self, entries):
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) > MAX_BYTES:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+            # One write() per request on an O_APPEND file: lines from
+            # different workers never interleave mid-line
+            with open(self.path, 'a') as f:
+                f.write(data)
+
+    def entries(self):
+        """Every logged entry, oldest first (including the rotated file)."""
+        for path in (self.path + '.1', self.path):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                continue
+
+    def report(self):
+        """
+        Entries grouped by normalized SQL, slowest total first. Each group has
+        count, total/mean/max ms, the endpoints and parameter shapes seen, the
+        latest plan, and whether any captured plan scanned the stock table.
+        """
+        groups = {}
+        for entry in self.entries():
+            group = groups.get(entry['sql'])
+            if group is None:
+                group = groups[entry['sql']] = {
+                    'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'endpoints': set(), 'params': set(), 'stock_scan': False,
+                }
+            group['count'] += 1
+            group['total_ms'] += entry['ms']
+            group['max_ms'] = max(group['max_ms'], entry['ms'])
+            group['endpoints'].add(entry['endpoint'])
+            group['params'].add(entry['params'])
+            group['stock_scan'] = group['stock_scan'] or entry['stock_scan']
+            group['plan'] = entry['plan']
+            group['last_seen'] = entry['at']
+        report = sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
+        for group in report:
+            group['total_ms'] = round(group['total_ms'], 3)
+            group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+            group['endpoints'] = sorted(group['endpoints'])
+            group['params'] = sorted(group['params'])
+        return report
+
+    def clear(self):
+        with self._lock:
+            for path in (self.path, self.path + '.1'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,76 @@
+"""
+Canonical stock statuses.
+
+stock.status holds one of the codes below (enforced by a foreign key to the
+`statuses` table). Every write path runs user or CSV input through
+`normalize_status()` so queries can filter with plain, indexable equality /
+IN lookups instead of UPPER() and case-variant OR-lists.
+"""
+
+# (code, label, category). Categories group codes for the dashboard.
+STATUSES = [
+    ('FOR SALE', 'For Sale (Warehouse)', 'in_stock'),
+    ('IN WAREHOUSE', 'In Warehouse', 'in_stock'),
+    ('SOLD', 'Sold', 'sold'),
+    ('INSTALLED', 'Installed', 'deployed'),
+    ('MAINTENANCE', 'Under Maintenance', 'repair'),
+    ('REPAIR', 'Repair', 'repair'),
+    ('IN TRANSIT', 'In Transit', 'transit'),
+]
+
+CODES = [code for code, _, _ in STATUSES]
+LABELS = {code: label for code, label, _ in STATUSES}
+DEFAULT = 'FOR SALE'
+
+# Other codes in the `statuses` table, by category: legacy values that
+# migration 3 kept (as 'other', unless recategorized since). Filled by
+# load_codes() at startup.
+EXTRA_CODES = {}
+
+# Free-text spellings seen in exports and hand-edited CSVs
+ALIASES = {
+    'AVAILABLE': 'FOR SALE',
+    'FORSALE': 'FOR SALE',
+    'FOR_SALE': 'FOR SALE',
+    'IN STOCK': 'IN WAREHOUSE',
+    'WAREHOUSE': 'IN WAREHOUSE',
+    'IN_WAREHOUSE': 'IN WAREHOUSE',
+    'DEPLOYED': 'INSTALLED',
+    'UNDER MAINTENANCE': 'MAINTENANCE',
+    'IN REPAIR': 'REPAIR',
+    'TRANSIT': 'IN TRANSIT',
+    'IN_TRANSIT': 'IN TRANSIT',
+}
+
+
+def load_codes(db):
+    """Accept every code the `statuses` table holds, not only STATUSES."""
+    EXTRA_CODES.update((code, category) for code, category in db.execute("SELECT code, category FROM statuses")
+                       if code not in LABELS)
+
+
+def codes_in(*categories):
+    """All codes belonging to the given dashboard categories, e.g. 'in_stock'."""
+    return ([code for code, _, cat in STATUSES if cat in categories] +
+            [code for code, cat in EXTRA_CODES.items() if cat in categories])
+
+
+def placeholders(codes):
+    """'?, ?, ...' for binding `codes` to an IN list."""
+    return ', '.join('?' * len(codes))
+
+
+def normalize_status(value):
+    """
+    Map free text to a canonical status code.
+
+    Case and surrounding/repeated whitespace are ignored. Legacy codes from
+    the `statuses` table (see load_codes) are accepted as they are. Returns
+    None if the value matches no known code or alias, so callers can report it.
+    """
+    if value is None:
+        return None
+    key = ' '.join(str(value).split()).upper()
+    if key in LABELS or key in EXTRA_CODES:
+        return key
+    return ALIASES.get(key)
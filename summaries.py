@@ -0,0 +1,130 @@
+"""
+Pre-aggregated stock counts for the dashboard.
+
+Two summary tables hold unit counts per (warehouse, fixture, status) and per
+(client, fixture, status). Triggers on stock (created by migration 4) keep
+them current on every INSERT, UPDATE and DELETE, so /inventory reads a few
+hundred rows no matter how many units are tracked. Units without a
+warehouse are counted under warehouse_id 0; units without a client are not
+counted in the client summary at all.
+
+`rebuild()` recomputes both tables from stock and `drift()` reports where
+the stored counts disagree with a fresh aggregate.
+"""
+
+# (table, key columns, SELECT producing fresh counts keyed the same way)
+SUMMARIES = [
+    ('stock_summary_warehouse', ('warehouse_id', 'fixture_id', 'status'), """
+        SELECT COALESCE(warehouse_id, 0) AS warehouse_id, fixture_id, status, COUNT(*) AS qty
+        FROM stock
+        GROUP BY 1, 2, 3
+    """),
+    ('stock_summary_client', ('client_id', 'fixture_id', 'status'), """
+        SELECT client_id, fixture_id, status, COUNT(*) AS qty
+        FROM stock
+        WHERE client_id IS NOT NULL
+        GROUP BY 1, 2, 3
+    """),
+]
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS stock_summary_warehouse (
+        warehouse_id INTEGER NOT NULL,   -- 0 = no warehouse (deployed / in transit)
+        fixture_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY (warehouse_id, fixture_id, status)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_summary_client (
+        client_id INTEGER NOT NULL,
+        fixture_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY (client_id, fixture_id, status)
+    ) WITHOUT ROWID
+    """,
+]
+
+# Trigger bodies reuse these per-row adjustments with NEW/OLD substituted.
+_ADD = """
+    INSERT INTO stock_summary_warehouse (warehouse_id, fixture_id, status, qty)
+    VALUES (COALESCE({r}.warehouse_id, 0), {r}.fixture_id, {r}.status, 1)
+    ON CONFLICT (warehouse_id, fixture_id, status) DO UPDATE SET qty = qty + 1;
+    INSERT INTO stock_summary_client (client_id, fixture_id, status, qty)
+    SELECT {r}.client_id, {r}.fixture_id, {r}.status, 1 WHERE {r}.client_id IS NOT NULL
+    ON CONFLICT (client_id, fixture_id, status) DO UPDATE SET qty = qty + 1;
+"""
+_REMOVE = """
+    UPDATE stock_summary_warehouse SET qty = qty - 1
+    WHERE warehouse_id = COALESCE({r}.warehouse_id, 0) AND fixture_id = {r}.fixture_id AND status = {r}.status;
+    DELETE FROM stock_summary_warehouse
+    WHERE warehouse_id = COALESCE({r}.warehouse_id, 0) AND fixture_id = {r}.fixture_id AND status = {r}.status
+      AND qty <= 0;
+    UPDATE stock_summary_client SET qty = qty - 1
+    WHERE client_id = {r}.client_id AND fixture_id = {r}.fixture_id AND status = {r}.status;
+    DELETE FROM stock_summary_client
+    WHERE client_id = {r}.client_id AND fixture_id = {r}.fixture_id AND status = {r}.status
+      AND qty <= 0;
+"""
+
+CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_summary_insert AFTER INSERT ON stock
+    BEGIN {_ADD.format(r='NEW')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_summary_delete AFTER DELETE ON stock
+    BEGIN {_REMOVE.format(r='OLD')} END
+    """,
+    # Only the grouped columns matter; edits to dates etc. don't fire this.
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_summary_update
+    AFTER UPDATE OF warehouse_id, client_id, fixture_id, status ON stock
+    WHEN OLD.warehouse_id IS NOT NEW.warehouse_id OR OLD.client_id IS NOT NEW.client_id
+      OR OLD.fixture_id IS NOT NEW.fixture_id OR OLD.status IS NOT NEW.status
+    BEGIN {_REMOVE.format(r='OLD')} {_ADD.format(r='NEW')} END
+    """,
+]
+
+
+def install(db):
+    """Create the summary tables and the stock triggers that maintain them."""
+    for sql in CREATE_TABLES + CREATE_TRIGGERS:
+        db.execute(sql)
+
+
+def rebuild(db):
+    """Recompute both summary tables from scratch. Caller commits."""
+    for table, keys, fresh_sql in SUMMARIES:
+        db.execute(f"DELETE FROM {table}")
+        db.execute(f"INSERT INTO {table} ({', '.join(keys)}, qty) {fresh_sql}")
+
+
+def drift(db):
+    """
+    Compare stored summaries with a fresh aggregate of stock.
+
+    Returns a list of (table, key dict, stored qty, actual qty) for every
+    group that differs. An empty list means the summaries are exact.
+    """
+    problems = []
+    for table, keys, fresh_sql in SUMMARIES:
+        join = " AND ".join(f"t.{k} = a.{k}" for k in keys)
+        key_cols = ", ".join(f"a.{k}" for k in keys)
+        stored_keys = ", ".join(f"t.{k}" for k in keys)
+        rows = db.execute(f"""
+            WITH actual AS ({fresh_sql})
+            SELECT {key_cols}, t.qty AS stored, a.qty AS actual
+            FROM actual a LEFT JOIN {table} t ON {join}
+            WHERE t.qty IS NOT a.qty
+            UNION ALL
+            SELECT {stored_keys}, t.qty AS stored, NULL AS actual
+            FROM {table} t
+            WHERE t.qty <> 0 AND NOT EXISTS (SELECT 1 FROM actual a WHERE {join})
+        """).fetchall()
+        for row in rows:
+            problems.append((table, dict(zip(keys, row[:len(keys)])), row[-2] or 0, row[-1] or 0))
+    return problems
@@ -0,0 +1,20 @@
+"""
+Every test module runs against one small generated database.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='lumipro-test-'), 'test.db')
+# database.py reads the path at import, so set it before anything imports it
+os.environ['LUMIPRO_DATABASE'] = DATABASE
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+sys.path.insert(0, REPO_DIR)
+
+import generate  # noqa: E402
+
+generate.generate(DATABASE, units=500, fixtures=20, clients=20)
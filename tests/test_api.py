@@ -0,0 +1,45 @@
+"""
+Smoke tests for the JSON API, against a small generated database (see conftest.py).
+"""
+
+import app  # noqa: E402
+
+
+def test_inventory_returns_dashboard_figures():
+    response = app.app.test_client().get('/api/v1/inventory')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['stats']['total_units'] == 500
+    assert data['inventory_split'] and data['sales_split']
+    # Template-only lookups stay out of the payload
+    assert not set(app.DASHBOARD_LOOKUPS) & set(data)
+
+
+def test_bulk_write_rejects_nested_values():
+    client = app.app.test_client()
+    response = client.post('/api/v1/warehouses',
+                           json=[{'name': 'Nested'}, {'name': ['x']}, {'name': 'y', 'location': {}}])
+    assert response.status_code == 422
+    assert response.get_json()['errors'] == [
+        {'index': 1, 'error': "name must be a string, number, boolean or null."},
+        {'index': 2, 'error': "location must be a string, number, boolean or null."}]
+    response = client.patch('/api/v1/warehouses', json=[{'id': [1], 'name': 'x'}])
+    assert response.status_code == 422
+    assert client.get('/api/v1/warehouses?limit=1000').get_json()['data'][-1]['name'] != 'Nested'
+
+
+def test_dashboard_counts_legacy_codes_by_category():
+    client = app.app.test_client()
+    before = client.get('/api/v1/inventory').get_json()['stats']
+
+    def retire(db):
+        db.execute("INSERT INTO statuses (code, label, category) VALUES ('RETIRED SOLD', 'Retired', 'sold')")
+        db.execute("UPDATE stock SET status = 'RETIRED SOLD' WHERE id = (SELECT MIN(id) FROM stock WHERE status = 'SOLD')")
+    app.db_writer.run(retire)
+    db = app.connect_db()
+    app.statuses.load_codes(db)
+    db.close()
+
+    assert 'RETIRED SOLD' in app.statuses.codes_in('sold')
+    after = client.get('/api/v1/inventory').get_json()['stats']
+    assert after['total_sold'] == before['total_sold']
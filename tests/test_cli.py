@@ -0,0 +1,18 @@
+"""Tests for the flask CLI commands."""
+
+import app
+
+
+def test_explain_routes_traces_every_route():
+    result = app.app.test_cli_runner().invoke(args=['explain-routes'])
+    assert result.exit_code == 0, result.output
+    routes = {r.split('\n', 1)[0]: r for r in result.output.split('\n== ')[1:]}
+    # Every route that reads the database, not just the first one requested
+    traced = [head for head, r in routes.items() if 'SELECT' in r]
+    assert len(traced) > 1
+    assert len(traced) == len(routes) - 2  # /metrics and /metrics/slow-queries run no SQL
+    for head in ('inventory  GET /inventory', 'api_list  GET /api/v1/fixtures'):
+        assert 'SELECT' in routes[head]
+    # A keyset page reads in id order and stops at the LIMIT: not a table scan
+    assert '!!' not in routes['api_list  GET /api/v1/stock']
+    assert '!!' in routes['export_stock_csv  GET /stock/export-csv']
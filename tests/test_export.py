@@ -0,0 +1,34 @@
+"""Tests for the stock export."""
+
+import io
+
+import pytest
+
+import app
+
+
+def test_unknown_format_is_rejected():
+    response = app.app.test_client().get('/stock/export-csv?format=xlsx')
+    assert response.status_code == 400
+    assert b"csv, parquet, arrow" in response.data
+
+
+def test_csv_keeps_the_bulk_update_columns():
+    response = app.app.test_client().get('/stock/export-csv')
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == ','.join(app.EXPORT_COLUMNS)
+    assert len(lines) == 501
+
+
+def test_parquet_columns_are_typed():
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    response = app.app.test_client().get('/stock/export-csv?format=parquet')
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.data))
+    assert table.num_rows == 500
+    assert table.schema.field('id').type == pa.int64()
+    assert table.schema.field('warehouse_id').type == pa.int64()
+    assert table.schema.field('mfg_date').type == pa.date32()
+    assert table.column('mfg_date').null_count < table.num_rows